@@ -1 +1,3 @@
-from .client import *
\ No newline at end of file
+from .client import *
+from .http_pool import *
+from .async_client import *
\ No newline at end of file
@@ -0,0 +1,63 @@
+import asyncio
+import json
+import logging
+
+import aipacenotes.settings
+from .client import (
+    HEADER_UUID,
+    BATCH_FRAME_HEADER,
+    create_pacenotes_audio_url,
+    create_pacenotes_audio_batch_url,
+    mkurl,
+)
+from . import client
+
+# the same calls as client.py, made on an aiohttp session for the AsyncEngine.
+
+def _headers():
+    return {
+        "Content-Type": "application/json",
+        HEADER_UUID: aipacenotes.settings.user_settings.get_uuid(),
+    }
+
+# returns the response, with the body not yet read. the caller must release() it.
+async def post_create_pacenote_audio_async(session, note_name, note_text, voice_config):
+    data = {
+        "note_name": note_name,
+        "note_text": note_text,
+        "voice_config": voice_config,
+    }
+
+    return await session.post(mkurl(create_pacenotes_audio_url), data=json.dumps(data), headers=_headers())
+
+# returns the response, with the body not yet read, or None if the server doesn't
+# support batches. the caller must release() the response.
+async def post_create_pacenotes_audio_batch_async(session, notes, voice_config):
+    if client.batch_unsupported:
+        return None
+
+    data = {
+        "notes": [{"note_name": name, "note_text": text} for name, text in notes],
+        "voice_config": voice_config,
+    }
+
+    response = await session.post(mkurl(create_pacenotes_audio_batch_url), data=json.dumps(data), headers=_headers())
+
+    if response.status in (404, 405):
+        logging.info("server doesnt support batched audio, falling back to one request per note")
+        client.batch_unsupported = True
+        response.release()
+        return None
+
+    return response
+
+# yields (index, ok, payload) as frames arrive.
+async def iter_batch_frames_async(content):
+    while True:
+        try:
+            header = await content.readexactly(BATCH_FRAME_HEADER.size)
+            index, ok, length = BATCH_FRAME_HEADER.unpack(header)
+            payload = await content.readexactly(length)
+        except asyncio.IncompleteReadError:
+            return
+        yield index, ok == 1, payload
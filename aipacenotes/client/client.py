@@ -1,12 +1,15 @@
 import json
 import logging
+import struct
 import requests
 import aipacenotes.settings
+from .http_pool import http_pool
 
 HEADER_UUID = 'X-Aip-Client-UUID'
 
 # healthcheck_url = '/healthcheck'
 create_pacenotes_audio_url = '/pacenotes/audio/create'
+create_pacenotes_audio_batch_url = '/pacenotes/audio/create_batch'
 transcribe_url = '/transcribe'
 translate_all_url = '/translate_all'
 
@@ -40,21 +43,21 @@ def mkurl(suffix):
 #     else:
 #         return True
 
-def post_create_pacenote_audio(note_name, note_text, voice_config):
-    data = {
-        "note_name": note_name,
-        "note_text": note_text,
-        "voice_config": voice_config,
-    }
+# connects the requests pool to the vocalizer (and any `extra_urls`) ahead of the first
+# real request. audio generation warms up its own connections with AsyncEngine.warm_up().
+def warm_up(extra_urls=()):
+    http_pool().warm_up([mkurl('/')] + list(extra_urls))
 
-    headers = {
-        "Content-Type": "application/json",
-        HEADER_UUID: aipacenotes.settings.user_settings.get_uuid(),
-    }
+# the batch response is a stream of frames, one per note in any order:
+# note index (u32), ok flag (u8), payload length (u32), then the payload, which is the
+# audio when ok and a utf-8 error message otherwise.
+BATCH_FRAME_HEADER = struct.Struct('>IBI')
 
-    response = requests.post(mkurl(create_pacenotes_audio_url), data=json.dumps(data), headers=headers)
+# set once the server says it doesn't know the batch endpoint.
+batch_unsupported = False
 
-    return response
+def encode_batch_frame(index, ok, payload):
+    return BATCH_FRAME_HEADER.pack(index, 1 if ok else 0, len(payload)) + payload
 
 def post_transcribe(fname):
     with open(fname, 'rb') as f:
@@ -62,7 +65,7 @@ def post_transcribe(fname):
         headers = {
             HEADER_UUID: aipacenotes.settings.user_settings.get_uuid(),
         }
-        response = requests.post(mkurl(transcribe_url), files=files, headers=headers)
+        response = http_pool().post(mkurl(transcribe_url), files=files, headers=headers)
 
         try:
             return response.json()
@@ -77,7 +80,7 @@ def post_translate_all(body):
         HEADER_UUID: aipacenotes.settings.user_settings.get_uuid(),
     }
 
-    response = requests.post(mkurl(translate_all_url), data=json.dumps(data), headers=headers)
+    response = http_pool().post(mkurl(translate_all_url), data=json.dumps(data), headers=headers)
 
     try:
         return response.json()
@@ -0,0 +1,61 @@
+import logging
+import threading
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# audio generation has its own aiohttp session on the AsyncEngine. this pool is for the
+# other backend calls (transcribe, translate) and the requests proxied for the game,
+# which are made from a handful of threads at a time.
+MAX_CONNECTIONS_PER_HOST = 10
+MAX_HOSTS = 4
+
+# one requests.Session shared by every backend call, so connections (and their TLS
+# handshakes) are kept alive and reused instead of opened per request. a host never
+# gets more than `max_per_host` connections; callers past that wait for a free one.
+class HttpPool:
+    def __init__(self, max_per_host=MAX_CONNECTIONS_PER_HOST, max_hosts=MAX_HOSTS):
+        self.max_per_host = max_per_host
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=max_hosts,
+            pool_maxsize=max_per_host,
+            pool_block=True,
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, url, **kwargs):
+        return self.session.get(url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.session.post(url, **kwargs)
+
+    # opens `connections` connections to each url's host in the background, so the first
+    # real requests don't pay for the tcp and tls handshakes.
+    def warm_up(self, urls, connections=2):
+        def _warm(url):
+            try:
+                self.session.head(url, timeout=10).close()
+            except requests.exceptions.RequestException as e:
+                logging.debug(f"couldnt warm up {url}: {e}")
+
+        for url in urls:
+            parts = urllib.parse.urlsplit(url)
+            base_url = f"{parts.scheme}://{parts.netloc}/"
+            for _ in range(min(connections, self.max_per_host)):
+                threading.Thread(target=_warm, args=(base_url,), daemon=True).start()
+
+    def close(self):
+        self.session.close()
+
+_http_pool = None
+_http_pool_lock = threading.Lock()
+
+def http_pool():
+    global _http_pool
+    with _http_pool_lock:
+        if _http_pool is None:
+            _http_pool = HttpPool()
+        return _http_pool
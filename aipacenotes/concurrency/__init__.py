@@ -1,2 +1,4 @@
 from .task_manager import *
-from .timer_thread import *
\ No newline at end of file
+from .timer_thread import *
+from .file_watcher import *
+from .async_engine import *
\ No newline at end of file
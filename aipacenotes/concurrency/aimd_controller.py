@@ -0,0 +1,92 @@
+import threading
+from collections import deque
+
+# picks how many requests should be in flight, the way tcp picks a window size: the
+# limit doubles after each round of requests whose p95 latency stayed close to the best
+# seen so far until the first cut, and goes up by one per round after that. it's cut
+# when the server starts failing (429/5xx, timeouts) or latency climbs, which means it's
+# queueing our requests instead of serving them.
+class AimdController:
+    def __init__(self, max_limit, min_limit=2, initial_limit=10, window=100,
+                 latency_tolerance=1.5, backoff_factor=0.5, latency_backoff_factor=0.75):
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        self.limit = max(self.min_limit, min(initial_limit, max_limit))
+        self.latency_tolerance = latency_tolerance
+        self.backoff_factor = backoff_factor
+        self.latency_backoff_factor = latency_backoff_factor
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=window)
+        self.baseline_p95 = None
+        self.round_count = 0
+        self.error_count = 0
+        # results to wait for after a cut, so a burst of failures from requests that were
+        # already in flight only cuts once.
+        self.cooldown = 0
+        # whether requests had to wait for a slot during this round. if they didn't, the
+        # limit isn't what's holding things back and there's no point raising it.
+        self.round_saturated = False
+        self.slow_start = True
+
+    def _p95(self):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def p95(self):
+        with self.lock:
+            return self._p95()
+
+    def _decrease(self, factor):
+        self.limit = max(self.min_limit, int(self.limit * factor))
+        self.round_count = 0
+        self.cooldown = self.limit
+        self.slow_start = False
+        # judge the new limit on its own latencies.
+        self.latencies.clear()
+
+    # call after every request. `failed` is for rate limiting, server errors and timeouts,
+    # not for requests the server rejected on their merits. `saturated` is whether other
+    # requests were waiting for a slot. returns the new limit.
+    def record(self, latency_sec, failed=False, saturated=True):
+        with self.lock:
+            if self.cooldown > 0:
+                self.cooldown -= 1
+
+            if failed:
+                self.error_count += 1
+                if self.cooldown == 0:
+                    self._decrease(self.backoff_factor)
+                return self.limit
+
+            self.latencies.append(latency_sec)
+            self.round_count += 1
+            self.round_saturated = self.round_saturated or saturated
+            if self.round_count < self.limit:
+                return self.limit
+
+            # a full round of requests at this limit is in.
+            self.round_count = 0
+            saturated = self.round_saturated
+            self.round_saturated = False
+            p95 = self._p95()
+
+            if self.baseline_p95 is None:
+                self.baseline_p95 = p95
+            elif p95 > self.baseline_p95 * self.latency_tolerance:
+                self._decrease(self.latency_backoff_factor)
+                return self.limit
+            else:
+                # follow the best latency down right away, and drift up slowly.
+                self.baseline_p95 = min(p95, self.baseline_p95 * 0.9 + p95 * 0.1)
+
+            if saturated:
+                increase = self.limit if self.slow_start else 1
+                self.limit = min(self.max_limit, self.limit + increase)
+            return self.limit
+
+    def status_str(self):
+        p95 = self.p95()
+        p95_str = f"{p95 * 1000:.0f}ms" if p95 is not None else "-"
+        return f"concurrency: {self.limit}/{self.max_limit} p95: {p95_str}"
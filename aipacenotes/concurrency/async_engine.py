@@ -0,0 +1,178 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import traceback
+import urllib.parse
+
+import aiohttp
+
+from .aimd_controller import AimdController
+
+# like asyncio.Semaphore, but when slots are scarce the waiter with the lowest priority
+# value goes next instead of the one that's been waiting longest. only used on the loop.
+class PriorityLimiter:
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self.waiters = []
+        self.seq = itertools.count()
+
+    def locked(self):
+        return self.in_use >= self.limit
+
+    async def acquire(self, priority):
+        if not self.locked() and not self.waiters:
+            self.in_use += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.seq), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # the slot was handed over just as the waiter was cancelled.
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    # hands the slot straight to the next waiter, if there is one.
+    def release(self):
+        # the limit was lowered, so this slot goes away.
+        if self.in_use > self.limit:
+            self.in_use -= 1
+            return
+
+        while self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_use -= 1
+
+    def set_limit(self, limit):
+        self.limit = limit
+        while self.in_use < self.limit and self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                self.in_use += 1
+                future.set_result(None)
+
+    def slot(self, priority):
+        return _LimiterSlot(self, priority)
+
+class _LimiterSlot:
+    def __init__(self, limiter, priority):
+        self.limiter = limiter
+        self.priority = priority
+
+    async def __aenter__(self):
+        await self.limiter.acquire(self.priority)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.limiter.release()
+
+# an asyncio loop on its own thread, for keeping many network requests in flight without
+# a thread parked on each one. coroutines are handed over with submit() from any thread,
+# and take a slot with `async with engine.limit(priority)` around each request, so the most
+# urgent requests go first. how many run at once is adjusted by an AimdController, up to
+# `max_in_flight`, from what's reported to record().
+class AsyncEngine:
+    def __init__(self, max_in_flight=50):
+        self.max_in_flight = max_in_flight
+        self.controller = AimdController(max_in_flight)
+        self.loop = None
+        self.thread = None
+        self.limiter = None
+        self.session = None
+        self.started = threading.Event()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        self.started.wait()
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.limiter = PriorityLimiter(self.controller.limit)
+        self.started.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.run_until_complete(self._cancel_tasks())
+            self.loop.run_until_complete(self._close_session())
+            self.loop.close()
+
+    def submit(self, coro):
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        future.add_done_callback(self.handle_future)
+        return future
+
+    def handle_future(self, future):
+        if future.cancelled():
+            return
+        e = future.exception()
+        if e:
+            logging.error(f"An error occurred in a coroutine: {e}")
+            traceback.print_exception(e)
+
+    # lower priority values go first.
+    def limit(self, priority=0):
+        return self.limiter.slot(priority)
+
+    # call on the loop after each request.
+    def record(self, latency_sec, failed=False):
+        saturated = len(self.limiter.waiters) > 0
+        self.limiter.set_limit(self.controller.record(latency_sec, failed, saturated))
+
+    # any status that means the server is overloaded rather than that the request was bad.
+    def is_overload_status(self, status_code):
+        return status_code == 429 or status_code >= 500
+
+    def status_str(self):
+        return self.controller.status_str()
+
+    # the aiohttp session lives on the loop, so it must be asked for from a coroutine.
+    async def http_session(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_in_flight, limit_per_host=self.max_in_flight)
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    # requests still in flight are cancelled before the session is closed under them, so
+    # they don't count as failed attempts.
+    async def _cancel_tasks(self):
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # opens `connections` connections to each url's host ahead of the first jobs, so they
+    # don't pay for the tcp and tls handshakes. call it after start(), from any thread.
+    def warm_up(self, urls, connections=2):
+        async def _warm(url):
+            session = await self.http_session()
+            try:
+                async with session.head(url, timeout=aiohttp.ClientTimeout(total=10)):
+                    pass
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.debug(f"couldnt warm up {url}: {e}")
+
+        for url in urls:
+            parts = urllib.parse.urlsplit(url)
+            base_url = f"{parts.scheme}://{parts.netloc}/"
+            for _ in range(min(connections, self.max_in_flight)):
+                self.submit(_warm(base_url))
+
+    async def _close_session(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def stop(self):
+        if self.loop is None or not self.loop.is_running():
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
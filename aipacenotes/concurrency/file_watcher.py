@@ -0,0 +1,479 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import stat
+import struct
+import sys
+import threading
+import time
+
+from PyQt6.QtCore import (
+    QThread,
+    pyqtSignal,
+)
+
+import aipacenotes.util
+
+if sys.platform == 'win32':
+    import pywintypes
+    import win32con
+    import win32event
+    import win32file
+
+# inotify(7) event bits.
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+INOTIFY_WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+    IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+)
+
+_inotify_event_header = struct.Struct('iIII')
+
+# CreateFile() access right for reading a directory's changes.
+FILE_LIST_DIRECTORY = 0x0001
+
+def _path_is_under(path, root):
+    return path == root or path.startswith(root + '/')
+
+# adds `path` to `changed` if it's under one of the roots. returns whether an ancestor of
+# a root changed, in which case the roots need to be watched again.
+def _add_changed(path, roots, changed):
+    rewatch = False
+    for root in roots:
+        if _path_is_under(path, root):
+            changed.add(path)
+        elif _path_is_under(root, path):
+            # an ancestor of the root appeared, moved or went away.
+            changed.add(root)
+            rewatch = True
+    return rewatch
+
+def _nearest_existing_dir(path):
+    path = os.path.dirname(path)
+    while path and not os.path.isdir(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+    return path or None
+
+class InotifyBackend:
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._inotify_add_watch = libc.inotify_add_watch
+        self._inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._inotify_rm_watch = libc.inotify_rm_watch
+        self._inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1 failed: {os.strerror(err)}")
+
+        self.roots = []
+        self.wd_to_dir = {}
+        self.dir_to_wd = {}
+
+    def name(self):
+        return 'inotify'
+
+    def close(self):
+        os.close(self.fd)
+
+    def set_roots(self, roots):
+        for wd in list(self.wd_to_dir):
+            self._inotify_rm_watch(self.fd, wd)
+        self.wd_to_dir = {}
+        self.dir_to_wd = {}
+        self.roots = list(roots)
+        self._watch_roots()
+
+    def _watch_roots(self):
+        for root in self.roots:
+            if os.path.isdir(root):
+                self._watch_tree(root)
+            else:
+                # files are watched through their directory so that atomic
+                # replace-by-rename is seen. missing paths are watched through
+                # their nearest existing ancestor until they show up.
+                parent = _nearest_existing_dir(root)
+                if parent:
+                    self._watch_dir(parent)
+
+    def _watch_dir(self, dirname):
+        if dirname in self.dir_to_wd:
+            return
+        wd = self._inotify_add_watch(self.fd, os.fsencode(dirname), INOTIFY_WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            logging.debug(f"inotify_add_watch failed for {dirname}: {os.strerror(err)}")
+            return
+        self.wd_to_dir[wd] = dirname
+        self.dir_to_wd[dirname] = wd
+
+    def _watch_tree(self, root):
+        for dirpath, dirnames, _ in os.walk(root):
+            self._watch_dir(aipacenotes.util.normalize_path(dirpath))
+
+    def wait(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changed = set()
+        rewatch = False
+        offset = 0
+
+        while offset + _inotify_event_header.size <= len(buf):
+            wd, mask, _cookie, name_len = _inotify_event_header.unpack_from(buf, offset)
+            offset += _inotify_event_header.size
+            name = buf[offset:offset + name_len].rstrip(b'\0')
+            offset += name_len
+
+            if mask & IN_Q_OVERFLOW:
+                changed.update(self.roots)
+                rewatch = True
+                continue
+
+            dirname = self.wd_to_dir.get(wd)
+            if dirname is None:
+                continue
+
+            if mask & IN_IGNORED:
+                self.wd_to_dir.pop(wd, None)
+                self.dir_to_wd.pop(dirname, None)
+                continue
+
+            path = dirname
+            if name:
+                path = f"{dirname}/{os.fsdecode(name)}"
+
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self._watch_tree(path)
+
+            if _add_changed(path, self.roots, changed):
+                rewatch = True
+
+        if rewatch:
+            self._watch_roots()
+
+        return changed
+
+class _DirWatch:
+    def __init__(self, dirname, recursive, handle, buf_size):
+        self.dirname = dirname
+        self.recursive = recursive
+        self.handle = handle
+        self.buf = win32file.AllocateReadBuffer(buf_size)
+        self.overlapped = pywintypes.OVERLAPPED()
+        self.overlapped.hEvent = win32event.CreateEvent(None, True, False, None)
+
+# ReadDirectoryChangesW() through pywin32. each watched directory has its own handle with
+# an overlapped read pending on it, so one wait covers all of them. directories are
+# watched with their whole subtree, and like with inotify, files and missing paths are
+# watched through their nearest existing directory.
+class ReadDirectoryChangesBackend:
+    def __init__(self, buf_size=64 * 1024):
+        if sys.platform != 'win32':
+            raise OSError("ReadDirectoryChangesW is only available on Windows")
+        self.buf_size = buf_size
+        self.notify_filter = (
+            win32con.FILE_NOTIFY_CHANGE_FILE_NAME | win32con.FILE_NOTIFY_CHANGE_DIR_NAME |
+            win32con.FILE_NOTIFY_CHANGE_SIZE | win32con.FILE_NOTIFY_CHANGE_LAST_WRITE
+        )
+        self.roots = []
+        self.watches = []
+
+    def name(self):
+        return 'ReadDirectoryChangesW'
+
+    def close(self):
+        self._unwatch_all()
+
+    def set_roots(self, roots):
+        self.roots = list(roots)
+        self._watch_roots()
+
+    def _watch_roots(self):
+        self._unwatch_all()
+
+        # dir -> whether its subtree is watched too.
+        dirs = {}
+        for root in self.roots:
+            if os.path.isdir(root):
+                dirs[root] = True
+            else:
+                parent = _nearest_existing_dir(root)
+                if parent:
+                    dirs.setdefault(parent, False)
+
+        for dirname, recursive in dirs.items():
+            self._watch_dir(dirname, recursive)
+
+    def _watch_dir(self, dirname, recursive):
+        try:
+            handle = win32file.CreateFile(
+                dirname,
+                FILE_LIST_DIRECTORY,
+                win32con.FILE_SHARE_READ | win32con.FILE_SHARE_WRITE | win32con.FILE_SHARE_DELETE,
+                None,
+                win32con.OPEN_EXISTING,
+                win32con.FILE_FLAG_BACKUP_SEMANTICS | win32con.FILE_FLAG_OVERLAPPED,
+                None,
+            )
+        except pywintypes.error as e:
+            logging.debug(f"couldnt open {dirname} to watch it: {e.strerror}")
+            return
+
+        watch = _DirWatch(dirname, recursive, handle, self.buf_size)
+        try:
+            self._read(watch)
+        except pywintypes.error as e:
+            logging.debug(f"ReadDirectoryChangesW failed for {dirname}: {e.strerror}")
+            handle.Close()
+            return
+        self.watches.append(watch)
+
+    def _read(self, watch):
+        win32event.ResetEvent(watch.overlapped.hEvent)
+        win32file.ReadDirectoryChangesW(watch.handle, watch.buf, watch.recursive, self.notify_filter, watch.overlapped)
+
+    def _unwatch_all(self):
+        for watch in self.watches:
+            try:
+                win32file.CancelIo(watch.handle)
+                # the cancelled read has to be over before its buffer goes away.
+                win32file.GetOverlappedResult(watch.handle, watch.overlapped, True)
+            except pywintypes.error:
+                pass
+            watch.handle.Close()
+        self.watches = []
+
+    def _roots_in(self, dirname):
+        return [root for root in self.roots if _path_is_under(root, dirname)]
+
+    def wait(self, timeout):
+        if not self.watches:
+            time.sleep(timeout)
+            return set()
+
+        handles = [watch.overlapped.hEvent for watch in self.watches]
+        rc = win32event.WaitForMultipleObjects(handles, False, int(timeout * 1000))
+        if rc == win32event.WAIT_TIMEOUT:
+            return set()
+
+        changed = set()
+        rewatch = False
+
+        for watch in self.watches:
+            if win32event.WaitForSingleObject(watch.overlapped.hEvent, 0) != win32event.WAIT_OBJECT_0:
+                continue
+
+            try:
+                nbytes = win32file.GetOverlappedResult(watch.handle, watch.overlapped, False)
+            except pywintypes.error as e:
+                # the directory itself was removed or moved.
+                logging.debug(f"stopped watching {watch.dirname}: {e.strerror}")
+                changed.update(self._roots_in(watch.dirname))
+                rewatch = True
+                continue
+
+            if nbytes == 0:
+                # more changed than fit in the buffer, so what changed isn't known.
+                changed.update(self._roots_in(watch.dirname))
+            else:
+                for _action, name in win32file.FILE_NOTIFY_INFORMATION(watch.buf, nbytes):
+                    path = aipacenotes.util.normalize_path(os.path.join(watch.dirname, name))
+                    if _add_changed(path, self.roots, changed):
+                        rewatch = True
+
+            try:
+                self._read(watch)
+            except pywintypes.error as e:
+                logging.debug(f"ReadDirectoryChangesW failed for {watch.dirname}: {e.strerror}")
+                changed.update(self._roots_in(watch.dirname))
+                rewatch = True
+
+        if rewatch:
+            self._watch_roots()
+
+        return changed
+
+class PollingBackend:
+    def __init__(self, interval_sec):
+        self.interval_sec = interval_sec
+        self.roots = []
+        self.snapshot = {}
+        # dir -> (mtime_ns, subdirs). a dir is only re-listed when its mtime moves.
+        self._subdirs = {}
+
+    def name(self):
+        return 'polling'
+
+    def close(self):
+        pass
+
+    def set_roots(self, roots):
+        self.roots = list(roots)
+        self._subdirs = {}
+        self.snapshot = {root: self._signature(root) for root in self.roots}
+
+    def _signature(self, root):
+        try:
+            st = os.stat(root)
+        except OSError:
+            return None
+
+        if not stat.S_ISDIR(st.st_mode):
+            return (st.st_mtime_ns, st.st_size)
+
+        # dir -> mtime_ns.
+        sig = {}
+        stack = [root]
+        while stack:
+            dirname = stack.pop()
+            try:
+                mtime_ns = os.stat(dirname).st_mtime_ns
+            except OSError:
+                continue
+            sig[dirname] = mtime_ns
+
+            cached = self._subdirs.get(dirname)
+            if cached is None or cached[0] != mtime_ns:
+                subdirs = []
+                try:
+                    with os.scandir(dirname) as it:
+                        for entry in it:
+                            if entry.is_dir(follow_symlinks=False):
+                                subdirs.append(aipacenotes.util.normalize_path(entry.path))
+                except OSError:
+                    pass
+                cached = (mtime_ns, subdirs)
+                self._subdirs[dirname] = cached
+            stack.extend(cached[1])
+
+        return sig
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval_sec))
+        changed = set()
+        for root in self.roots:
+            sig = self._signature(root)
+            old_sig = self.snapshot.get(root)
+            if sig == old_sig:
+                continue
+            self.snapshot[root] = sig
+            if isinstance(sig, dict) and isinstance(old_sig, dict):
+                # the directories that had something added, removed or renamed in them.
+                changed.update(d for d in sig.keys() | old_sig.keys() if sig.get(d) != old_sig.get(d))
+            else:
+                changed.add(root)
+        return changed
+
+def make_watcher_backend(poll_interval_sec):
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyBackend()
+        except (OSError, AttributeError) as e:
+            logging.warning(f"inotify unavailable, falling back to polling: {e}")
+    elif sys.platform == 'win32':
+        try:
+            return ReadDirectoryChangesBackend()
+        except (OSError, pywintypes.error) as e:
+            logging.warning(f"ReadDirectoryChangesW unavailable, falling back to polling: {e}")
+    return PollingBackend(poll_interval_sec)
+
+class FileWatcher(QThread):
+    # emits the set of paths that changed since the last emit: files and directories under
+    # the watched paths, or a watched path itself when what changed under it isn't known.
+    # polling only sees which directories changed, so it reports those.
+    changed = pyqtSignal(object)
+
+    # polling stats the whole tree, so it's only the fallback for when neither inotify nor
+    # ReadDirectoryChangesW can be used, and runs less often.
+    def __init__(self, debounce_sec=0.1, max_delay_sec=0.4, poll_interval_sec=1.0):
+        super().__init__()
+        self.debounce_sec = debounce_sec
+        self.max_delay_sec = max_delay_sec
+        self.poll_interval_sec = poll_interval_sec
+        self._lock = threading.Lock()
+        self._paths = []
+        self._paths_dirty = False
+
+    # files and directories to watch. directories are watched recursively.
+    def set_paths(self, paths):
+        paths = sorted(set(aipacenotes.util.normalize_path(p) for p in paths if p))
+        with self._lock:
+            if paths != self._paths:
+                self._paths = paths
+                self._paths_dirty = True
+
+    def _take_paths(self):
+        with self._lock:
+            if not self._paths_dirty:
+                return None
+            self._paths_dirty = False
+            return list(self._paths)
+
+    def run(self):
+        backend = make_watcher_backend(self.poll_interval_sec)
+        logging.info(f"FileWatcher using {backend.name()} backend")
+
+        pending = set()
+        first_event_at = None
+        last_event_at = None
+
+        try:
+            while not self.isInterruptionRequested():
+                paths = self._take_paths()
+                if paths is not None:
+                    logging.debug(f"FileWatcher watching {paths}")
+                    backend.set_roots(paths)
+
+                timeout = 0.25
+                if last_event_at is not None:
+                    now = time.monotonic()
+                    deadline = min(last_event_at + self.debounce_sec, first_event_at + self.max_delay_sec)
+                    timeout = max(0.0, deadline - now)
+
+                changed = backend.wait(timeout)
+                now = time.monotonic()
+
+                if changed:
+                    pending |= changed
+                    last_event_at = now
+                    if first_event_at is None:
+                        first_event_at = now
+
+                if pending:
+                    settled = now - last_event_at >= self.debounce_sec
+                    overdue = now - first_event_at >= self.max_delay_sec
+                    if settled or overdue:
+                        self.changed.emit(pending)
+                        pending = set()
+                        first_event_at = None
+                        last_event_at = None
+        finally:
+            backend.close()
+
+    def stop(self):
+        self.requestInterruption()
@@ -28,6 +28,8 @@ from aipacenotes.tab_transcribe import TranscribeTabWidget
 from aipacenotes.settings import SettingsManager, SettingsDialog
 from aipacenotes.status_bar import StatusBarWidget
 import aipacenotes.util
+from aipacenotes import client as aip_client
+from aipacenotes.tab_network.proxy_request import BASE_URL as PROXY_BASE_URL
 
 APP_NAME = "AI Pacenotes"
 
@@ -92,15 +94,24 @@ class MainWindow(QMainWindow):
 
         self.setCentralWidget(self.top_lvl_widget)
 
+        aip_client.warm_up([PROXY_BASE_URL])
+
     def things_to_stop(self):
         if aipacenotes.util.is_windows():
             return [
                 # self.pacenotes_tab.timer_thread.stop,
                 # self.pacenotes_tab.task_manager.shutdown,
+                self.pacenotes_tab.file_watcher.stop,
+                self.pacenotes_tab.async_engine.stop,
+                self.pacenotes_tab.job_journal.close,
+                self.pacenotes_tab.tree.rally_scanner.save_index,
                 self.transcribe_tab.stop_recording_thread,
+                aip_client.http_pool().close,
             ]
         else:
-            return []
+            return [
+                aip_client.http_pool().close,
+            ]
 
     def open_settings_dialog(self):
         dialog = SettingsDialog()
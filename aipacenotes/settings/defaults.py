@@ -9,13 +9,36 @@ default_settings = {
     'settings_dir':       '$beam_user_home/settings/aipacenotes',
     'settings_fname_user': '$settings_dir/settings.json',
     'temp_dir':           '$beam_user_home/temp/aipacenotes',
+    'audio_store_dir':    '$temp_dir/audio_store',
+    'recycle_bin_dir':    '$temp_dir/recycle_bin',
     'transcripts_fname':   '$settings_dir/desktop.transcripts.json',
+    'scan_index_fname':    '$settings_dir/desktop.scan_index.json',
+    'jobs_journal_fname':  '$settings_dir/desktop.jobs.sqlite',
     'static_pacenotes_fnames': [
         '$mods_dir/repo/aipacenotes.zip/settings/aipacenotes/static_pacenotes.json',
         '$mods_dir/aipacenotes.zip/settings/aipacenotes/static_pacenotes.json',
         '$unpacked_mod_dir/settings/aipacenotes/static_pacenotes.json',
         '$settings_dir/static_pacenotes.json'
     ],
+    'notebook_backups': {
+        # a backup is dropped once any of these is exceeded. the newest is always kept.
+        'max_count': 10,
+        'max_total_mb': 50,
+        'max_age_days': 30,
+    },
+    'audio_store': {
+        # generated audio is shared from here until the store gets this big, or it hasn't
+        # been used for this long.
+        'max_total_mb': 500,
+        'max_age_days': 30,
+    },
+    'recycle_bin': {
+        # orphaned audio is kept around this long, or until the bin gets this big.
+        'max_total_mb': 200,
+        'max_age_days': 7,
+    },
+    # how many audio requests can be in flight at once.
+    'max_concurrent_requests': 50,
     'recording_cut_delay': 0.3,
     'voice_files': [
         # lowest priority.
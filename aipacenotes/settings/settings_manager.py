@@ -2,6 +2,7 @@ import json
 import pprint
 import logging
 import copy
+import hashlib
 import os
 import re
 
@@ -74,6 +75,7 @@ class SettingsManager():
     def __init__(self, status_bar):
         self.status_bar = status_bar
         self.voices = {}
+        self.voice_fingerprints = {}
         self.static_pacenotes = None
 
     def update_status_left(self, txt):
@@ -100,6 +102,12 @@ class SettingsManager():
     def get_recording_cut_delay(self):
         return self.settings['recording_cut_delay']
 
+    def get_notebook_backup_retention(self):
+        return self.settings['notebook_backups']
+
+    def get_max_concurrent_requests(self):
+        return self.settings['max_concurrent_requests']
+
     def get_pacenotes_search_paths(self):
         return self.settings['notebooks_search_paths']
 
@@ -109,6 +117,14 @@ class SettingsManager():
         # print(os.path.join(self.get_settings_dir(), self.settings['transcripts_fname']))
         return self.settings['transcripts_fname']
 
+    def get_scan_index_fname(self):
+        self.get_settings_dir()
+        return self.settings['scan_index_fname']
+
+    def get_jobs_journal_fname(self):
+        self.get_settings_dir()
+        return self.settings['jobs_journal_fname']
+
     def get_static_pacenotes(self, force=False):
         if force:
             self.static_pacenotes = None
@@ -154,6 +170,22 @@ class SettingsManager():
         os.makedirs(val, exist_ok=True)
         return  val
 
+    def get_audio_store_dir(self):
+        val = self.settings['audio_store_dir']
+        os.makedirs(val, exist_ok=True)
+        return  val
+
+    def get_audio_store_limits(self):
+        return self.settings['audio_store']
+
+    def get_recycle_bin_dir(self):
+        val = self.settings['recycle_bin_dir']
+        os.makedirs(val, exist_ok=True)
+        return  val
+
+    def get_recycle_bin_limits(self):
+        return self.settings['recycle_bin']
+
     def get_settings_path_user(self):
         return self.settings['settings_fname_user']
 
@@ -205,6 +237,7 @@ class SettingsManager():
         voices_files = self.settings['voice_files']
         logging.info(f"loading {len(voices_files)} voice files")
         self.voices = {}
+        self.voice_fingerprints = {}
         ext = '.zip'
 
         for e in voices_files:
@@ -244,5 +277,38 @@ class SettingsManager():
             zip_fname, inner_fname = file_path.split(ext+'/')
             return (zip_fname+ext, inner_fname)
 
+    # the files on disk whose changes should trigger a reload of voices or static pacenotes.
+    # paths inside a zip map to the zip file itself.
+    def watched_fnames(self):
+        fnames = []
+        ext = '.zip'
+
+        for fname in self.settings['voice_files'] + self.settings['static_pacenotes_fnames']:
+            if ext in fname:
+                zip_fname, _ = self.split_path_after_ext(ext, fname)
+                if zip_fname:
+                    fnames.append(zip_fname)
+            else:
+                fnames.append(fname)
+
+        return fnames
+
+    def reload_watched_files(self):
+        self.load_voices()
+        self.get_static_pacenotes(True)
+
     def voice_config(self, voice):
         return self.voices.get(voice, None)
+
+    # identifies what a voice sounds like, so audio can be shared by every codriver using
+    # the same config regardless of what the voice is called.
+    def voice_config_fingerprint(self, voice):
+        fingerprint = self.voice_fingerprints.get(voice)
+        if fingerprint is None:
+            voice_config = self.voice_config(voice)
+            if voice_config is None:
+                return None
+            data = json.dumps(voice_config, sort_keys=True, ensure_ascii=False)
+            fingerprint = hashlib.sha1(data.encode('utf-8')).hexdigest()
+            self.voice_fingerprints[voice] = fingerprint
+        return fingerprint
@@ -1,11 +1,11 @@
 import json
-import requests
 import time
 from datetime import datetime
 import uuid
 
 import aipacenotes.util
 import aipacenotes.settings
+from aipacenotes.client import http_pool
 
 if aipacenotes.util.is_dev() and aipacenotes.util.is_mac():
     BASE_URL = 'http://localhost:3000'
@@ -68,11 +68,11 @@ class ProxyRequest:
 
         if self.method() == 'GET':
             self._request_size = 0
-            self.response = requests.get(url, headers=headers, params=params)
+            self.response = http_pool().get(url, headers=headers, params=params)
         if self.method() == 'POST':
             request_body = json.dumps(self.body()).encode('utf-8')
             self._request_size = len(request_body)
-            self.response = requests.post(url, data=request_body, headers=headers, params=params)
+            self.response = http_pool().post(url, data=request_body, headers=headers, params=params)
 
         if self.response:
             self.response_json = self.response.json()
@@ -0,0 +1,52 @@
+import os
+import tempfile
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+PARTIAL_SUFFIX = '.part'
+OGG_MAGIC = b'OggS'
+# an ogg page header alone is this long, so anything shorter can't be audio.
+MIN_AUDIO_BYTES = 27
+
+# audio being written to `dest` a chunk at a time. it goes to a temp file in the same
+# directory, which only replaces `dest` in commit(), once it's complete, on disk and looks
+# like audio. a half-written or bad download never shows up under the real name.
+class AudioDownload:
+    def __init__(self, dest):
+        self.dest = dest
+        dirname, basename = os.path.split(dest)
+        fd, self.tmp_fname = tempfile.mkstemp(dir=dirname, prefix=f'{basename}.', suffix=PARTIAL_SUFFIX)
+        self.f = os.fdopen(fd, 'wb')
+        self.size = 0
+        self.head = b''
+
+    def write(self, chunk):
+        if len(self.head) < len(OGG_MAGIC):
+            self.head += chunk[:len(OGG_MAGIC) - len(self.head)]
+        self.f.write(chunk)
+        self.size += len(chunk)
+
+    def validate(self):
+        if self.size < MIN_AUDIO_BYTES:
+            raise ValueError(f"audio too short: {self.size} bytes")
+        if self.head != OGG_MAGIC:
+            raise ValueError(f"not ogg audio: starts with {self.head!r}")
+
+    # raises ValueError for bad audio and OSError for disk trouble. either way the temp
+    # file is removed and `dest` is left as it was.
+    def commit(self):
+        try:
+            self.validate()
+            self.f.flush()
+            os.fsync(self.f.fileno())
+            self.f.close()
+            os.replace(self.tmp_fname, self.dest)
+        except BaseException:
+            self.abort()
+            raise
+
+    def abort(self):
+        self.f.close()
+        try:
+            os.remove(self.tmp_fname)
+        except FileNotFoundError:
+            pass
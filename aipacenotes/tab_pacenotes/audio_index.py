@@ -0,0 +1,162 @@
+import os
+import threading
+
+import aipacenotes.util
+from .audio_download import PARTIAL_SUFFIX
+
+# files that only exist while the app is writing something.
+TEMP_SUFFIXES = (PARTIAL_SUFFIX, '.tmp')
+
+def is_temp_name(name):
+    return name.endswith(TEMP_SUFFIXES)
+
+# in-memory view of which generated audio files exist, one set of basenames per
+# codriver directory. each directory costs a single os.scandir the first time it's
+# asked about, and is kept up to date by the code that writes and deletes files.
+# changes made outside the app are picked up by invalidating the index.
+class AudioIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.dirs = {}
+        self.subdirs = {}
+        self.scan_count = 0
+
+    def _split(self, path):
+        path = aipacenotes.util.normalize_path(path)
+        dirname, _, basename = path.rpartition('/')
+        return dirname, basename
+
+    def _scan(self, dirname):
+        names = set()
+        try:
+            with os.scandir(dirname) as it:
+                for entry in it:
+                    if entry.is_file():
+                        names.add(entry.name)
+        except FileNotFoundError:
+            pass
+        return names
+
+    def _names(self, dirname):
+        with self.lock:
+            names = self.dirs.get(dirname)
+        if names is not None:
+            return names
+
+        names = self._scan(dirname)
+        with self.lock:
+            self.scan_count += 1
+            return self.dirs.setdefault(dirname, names)
+
+    def _scan_subdirs(self, dirname):
+        names = set()
+        try:
+            with os.scandir(dirname) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        names.add(entry.name)
+        except FileNotFoundError:
+            pass
+        return names
+
+    def _subdir_names(self, dirname):
+        with self.lock:
+            names = self.subdirs.get(dirname)
+        if names is not None:
+            return names
+
+        names = self._scan_subdirs(dirname)
+        with self.lock:
+            self.scan_count += 1
+            return self.subdirs.setdefault(dirname, names)
+
+    def exists(self, path):
+        dirname, basename = self._split(path)
+        return basename in self._names(dirname)
+
+    # the basenames of the files in `dirname`.
+    def files_in(self, dirname):
+        names = self._names(aipacenotes.util.normalize_path(dirname))
+        with self.lock:
+            return set(names)
+
+    # the full paths of the directories directly under `dirname`.
+    def subdirs_of(self, dirname):
+        dirname = aipacenotes.util.normalize_path(dirname)
+        names = self._subdir_names(dirname)
+        with self.lock:
+            return [f'{dirname}/{name}' for name in sorted(names)]
+
+    def add(self, path):
+        dirname, basename = self._split(path)
+        names = self._names(dirname)
+        parent, _, dir_basename = dirname.rpartition('/')
+        with self.lock:
+            names.add(basename)
+            if parent in self.subdirs:
+                self.subdirs[parent].add(dir_basename)
+
+    def remove(self, path):
+        dirname, basename = self._split(path)
+        names = self._names(dirname)
+        with self.lock:
+            names.discard(basename)
+
+    def remove_many(self, paths):
+        by_dir = {}
+        for path in paths:
+            dirname, basename = self._split(path)
+            by_dir.setdefault(dirname, []).append(basename)
+        for dirname, basenames in by_dir.items():
+            names = self._names(dirname)
+            with self.lock:
+                names.difference_update(basenames)
+
+    # whether what the index has for `path`, a file or a directory, still matches the
+    # disk. what hasn't been scanned can't be out of date, and a directory that has been is
+    # listed again to compare. temp files are left out of that.
+    def reflects(self, path):
+        dirname, basename = self._split(path)
+        path = f'{dirname}/{basename}'
+        is_dir = os.path.isdir(path)
+        is_file = not is_dir and os.path.isfile(path)
+
+        with self.lock:
+            names = self.dirs.get(dirname)
+            if names is not None and (basename in names) != is_file:
+                return False
+            subdirs = self.subdirs.get(dirname)
+            if subdirs is not None and (basename in subdirs) != is_dir:
+                return False
+            own_names = self.dirs.get(path)
+            own_names = None if own_names is None else set(own_names)
+            own_subdirs = self.subdirs.get(path)
+            own_subdirs = None if own_subdirs is None else set(own_subdirs)
+
+        if own_names is not None:
+            def settled(names):
+                return set(name for name in names if not is_temp_name(name))
+            if settled(own_names) != settled(self._scan(path)):
+                return False
+        if own_subdirs is not None and own_subdirs != self._scan_subdirs(path):
+            return False
+        return True
+
+    def remove_dir(self, dirname):
+        dirname = aipacenotes.util.normalize_path(dirname)
+        parent, _, basename = dirname.rpartition('/')
+        with self.lock:
+            self.dirs.pop(dirname, None)
+            self.subdirs.pop(dirname, None)
+            if parent in self.subdirs:
+                self.subdirs[parent].discard(basename)
+
+    def invalidate(self, dirname=None):
+        with self.lock:
+            if dirname is None:
+                self.dirs = {}
+                self.subdirs = {}
+            else:
+                dirname = aipacenotes.util.normalize_path(dirname)
+                self.dirs.pop(dirname, None)
+                self.subdirs.pop(dirname, None)
@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+import aipacenotes.util
+
+# generated audio keyed by what was synthesized: the note text and a fingerprint of the
+# voice config. the same text in the same voice is only ever requested from the server
+# once, no matter how many notebooks, codrivers or static pacenotes use it. files are
+# placed into the generated_pacenotes dirs as hardlinks, or copies where linking fails.
+# the store is a cache: the least recently used audio is dropped once the total size or
+# its age goes over the limits. placed files keep their audio either way, and the recycle
+# bin only deletes an orphaned file while it's still linked from here.
+class AudioStore:
+    ext = '.ogg'
+
+    def __init__(self, root_dir, max_bytes, max_age_sec):
+        self.root_dir = aipacenotes.util.normalize_path(root_dir)
+        self.max_bytes = max_bytes
+        self.max_age_sec = max_age_sec
+        self.lock = threading.Lock()
+        # key -> [size, last used], least recently used first.
+        self.entries = None
+        self.total_bytes = 0
+        # key -> Event, for audio that's being generated right now.
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.evicted_count = 0
+
+    def key(self, note_text, voice_fingerprint):
+        payload = json.dumps([note_text, voice_fingerprint], ensure_ascii=False)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def path_for(self, key):
+        return f'{self.root_dir}/{key[:2]}/{key}{self.ext}'
+
+    # call with the lock held.
+    def _ensure_loaded(self):
+        if self.entries is not None:
+            return
+
+        found = []
+        try:
+            with os.scandir(self.root_dir) as it:
+                for entry in it:
+                    if not entry.is_dir():
+                        continue
+                    with os.scandir(entry.path) as files:
+                        for f in files:
+                            if f.name.endswith(self.ext):
+                                st = f.stat()
+                                found.append((st.st_mtime, f.name[:-len(self.ext)], st.st_size))
+        except FileNotFoundError:
+            pass
+
+        found.sort()
+        self.entries = OrderedDict((key, [size, mtime]) for mtime, key, size in found)
+        self.total_bytes = sum(size for size, _ in self.entries.values())
+
+    def _evict(self, now):
+        while self.entries:
+            key, (size, used_at) = next(iter(self.entries.items()))
+            if self.total_bytes <= self.max_bytes and now - used_at <= self.max_age_sec:
+                break
+            self.entries.pop(key)
+            self.total_bytes -= size
+            self.evicted_count += 1
+            try:
+                os.remove(self.path_for(key))
+            except OSError as e:
+                logging.debug(f"couldnt evict {key} from the audio store: {e}")
+
+    def has(self, key):
+        with self.lock:
+            self._ensure_loaded()
+            return key in self.entries
+
+    # returns None if the caller should generate the audio for `key` and then call
+    # release(), or an Event that's set once whoever is generating it is done.
+    def acquire(self, key):
+        with self.lock:
+            event = self.pending.get(key)
+            if event is None:
+                self.pending[key] = threading.Event()
+            return event
+
+    def release(self, key):
+        with self.lock:
+            event = self.pending.pop(key, None)
+        if event:
+            event.set()
+
+    # adds the audio file at `src` to the store as `key`, linked where possible.
+    def adopt(self, key, src):
+        path = self.path_for(key)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                os.link(src, tmp_path)
+            except OSError:
+                shutil.copyfile(src, tmp_path)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            logging.error(f"couldnt add {src} to the audio store: {e}")
+            return False
+
+        now = time.time()
+        with self.lock:
+            self._ensure_loaded()
+            old = self.entries.pop(key, None)
+            if old:
+                self.total_bytes -= old[0]
+            self.entries[key] = [size, now]
+            self.total_bytes += size
+            self._evict(now)
+        return True
+
+    # puts the stored audio for `key` at `dest`. returns False if it isn't stored.
+    def place(self, key, dest):
+        with self.lock:
+            self._ensure_loaded()
+            if key not in self.entries:
+                self.misses += 1
+                return False
+
+        src = self.path_for(key)
+        tmp_dest = None
+        try:
+            # a name of its own, so placing the same dest twice at once can't collide. a
+            # crash can leave it behind, which the orphan collector cleans up.
+            dirname, basename = os.path.split(dest)
+            fd, tmp_dest = tempfile.mkstemp(dir=dirname, prefix=f'{basename}.', suffix='.tmp')
+            os.close(fd)
+            try:
+                # a link can't replace a file, so the name is only reserved.
+                os.remove(tmp_dest)
+                os.link(src, tmp_dest)
+            except OSError:
+                shutil.copyfile(src, tmp_dest)
+            os.replace(tmp_dest, dest)
+            tmp_dest = None
+        except FileNotFoundError:
+            # evicted meanwhile, or removed from the store behind our back.
+            with self.lock:
+                entry = self.entries.pop(key, None)
+                if entry:
+                    self.total_bytes -= entry[0]
+                self.misses += 1
+            return False
+        except OSError as e:
+            logging.error(f"couldnt place {src} at {dest}: {e}")
+            return False
+        finally:
+            if tmp_dest is not None:
+                try:
+                    os.remove(tmp_dest)
+                except OSError:
+                    pass
+
+        # the mtime is when it was last used, so the order survives a restart.
+        now = time.time()
+        try:
+            os.utime(src, (now, now))
+        except OSError:
+            pass
+
+        with self.lock:
+            self.hits += 1
+            entry = self.entries.get(key)
+            if entry:
+                entry[1] = now
+                self.entries.move_to_end(key)
+        return True
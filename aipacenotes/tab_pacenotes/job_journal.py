@@ -0,0 +1,111 @@
+import logging
+import os
+import sqlite3
+import threading
+
+JOURNAL_COLUMNS = ['id', 'notebook_fname', 'codriver_name', 'pacenote_name', 'note', 'status', 'attempts', 'updated_at']
+
+# the jobs that aren't done yet, in a sqlite file in the settings dir, so generation picks
+# up where it left off after a restart. changes are buffered in memory and written in one
+# transaction by flush(), so a job changing status never waits on the disk.
+class JobJournal:
+    def __init__(self, fname):
+        self.fname = fname
+        self.conn = None
+        self.lock = threading.Lock()
+        # held across a whole flush, so flushes can't overtake each other.
+        self.io_lock = threading.Lock()
+        # job id -> the row to write, or None to delete it.
+        self.changes = {}
+
+    def _connect(self):
+        if self.conn is None:
+            os.makedirs(os.path.dirname(self.fname), exist_ok=True)
+            self.conn = sqlite3.connect(self.fname, check_same_thread=False)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    notebook_fname TEXT NOT NULL,
+                    codriver_name TEXT NOT NULL,
+                    pacenote_name TEXT NOT NULL,
+                    note TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            ''')
+        return self.conn
+
+    def record(self, job):
+        pacenote = job.pacenote
+        row = (
+            job.id,
+            pacenote.notebook.notebook_file.fname,
+            pacenote.codriver_name(),
+            pacenote.name(),
+            job.note_text,
+            job.status(),
+            job.attempts,
+            job.updated_at(),
+        )
+        with self.lock:
+            self.changes[job.id] = row
+
+    def remove(self, id):
+        with self.lock:
+            self.changes[id] = None
+
+    def has_changes(self):
+        with self.lock:
+            return len(self.changes) > 0
+
+    def flush(self):
+        with self.io_lock:
+            with self.lock:
+                changes = self.changes
+                self.changes = {}
+
+            if not changes:
+                return
+
+            upserts = [row for row in changes.values() if row is not None]
+            deletes = [(id,) for id, row in changes.items() if row is None]
+
+            try:
+                conn = self._connect()
+                with conn:
+                    conn.executemany(f"INSERT OR REPLACE INTO jobs VALUES ({', '.join('?' * len(JOURNAL_COLUMNS))})", upserts)
+                    conn.executemany('DELETE FROM jobs WHERE id = ?', deletes)
+            except sqlite3.Error as e:
+                logging.error(f"couldnt write job journal {self.fname}, will retry: {e}")
+                # the next flush reconnects and writes these again, unless the job has
+                # changed since.
+                self._disconnect()
+                with self.lock:
+                    changes.update(self.changes)
+                    self.changes = changes
+
+    # rows as dicts, oldest first.
+    def load(self):
+        with self.io_lock:
+            try:
+                cursor = self._connect().execute(f"SELECT {', '.join(JOURNAL_COLUMNS)} FROM jobs ORDER BY updated_at")
+                return [dict(zip(JOURNAL_COLUMNS, row)) for row in cursor.fetchall()]
+            except sqlite3.Error as e:
+                logging.error(f"couldnt read job journal {self.fname}: {e}")
+                return []
+
+    def _disconnect(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except sqlite3.Error:
+                pass
+            self.conn = None
+
+    def close(self):
+        self.flush()
+        with self.io_lock:
+            self._disconnect()
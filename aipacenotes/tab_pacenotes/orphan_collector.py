@@ -0,0 +1,157 @@
+import os
+import time
+import logging
+import threading
+
+from .audio_index import is_temp_name
+from .voice_manifest import MANIFEST_FNAME
+
+# recycles generated audio that no pacenote of the selected notebook points at anymore.
+# it works off the notebook's AudioIndex rather than walking the disk, and only does
+# anything after the desired set of files changed or the index was invalidated. a file
+# has to stay orphaned for `grace_sec` before it's moved out, so a note that's edited and
+# then changed back keeps its audio instead of being regenerated. temp files left behind
+# by a crash are deleted after the same grace period, since there's nothing to keep.
+class OrphanCollector:
+    def __init__(self, get_recycle_bin, grace_sec=30.0, batch_size=50):
+        self.get_recycle_bin = get_recycle_bin
+        self.grace_sec = grace_sec
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.run_lock = threading.Lock()
+        self.notebook_file = None
+        self.pacenotes = None
+        self.desired = set()
+        self.dirty = False
+        # path -> time it was first seen orphaned.
+        self.candidates = {}
+        self.deleted_count = 0
+
+    # called on every refresh. cheap unless the notebook's pacenotes were rebuilt.
+    def set_desired(self, notebook_file):
+        notebook = notebook_file.notebook()
+        if notebook is None:
+            return
+
+        pacenotes = notebook.pacenotes()
+        with self.lock:
+            if notebook_file is self.notebook_file and pacenotes is self.pacenotes:
+                return
+
+        desired = set(pacenote.note_abs_path() for pacenote in pacenotes)
+
+        with self.lock:
+            if notebook_file is not self.notebook_file:
+                self.candidates = {}
+            self.notebook_file = notebook_file
+            self.pacenotes = pacenotes
+            if desired != self.desired:
+                self.desired = desired
+                self.dirty = True
+
+    # for when files changed on disk behind the index's back.
+    def mark_dirty(self):
+        with self.lock:
+            self.dirty = True
+
+    def has_work(self):
+        with self.lock:
+            return self.notebook_file is not None and (self.dirty or len(self.candidates) > 0)
+
+    def _find_orphans(self, notebook_file, desired):
+        notebook = notebook_file.notebook()
+        if notebook is None:
+            return set()
+
+        index = notebook_file.audio_index
+        orphans = set()
+        for codriver_dir in index.subdirs_of(notebook.pacenotes_dir()):
+            for name in index.files_in(codriver_dir):
+                path = f'{codriver_dir}/{name}'
+                if name.endswith('.ogg') and path not in desired:
+                    orphans.add(path)
+                # left behind by a download or copy that never finished. one that's still
+                # going is done or gone long before its grace period is.
+                elif is_temp_name(name):
+                    orphans.add(path)
+        return orphans
+
+    # the codriver dirs that had files deleted, then the notebook's dir above them.
+    def _remove_empty_dirs(self, notebook_file, dirnames):
+        index = notebook_file.audio_index
+        for dirname in sorted(dirnames) + [notebook_file.notebook().pacenotes_dir()]:
+            # the voice manifest only describes the files, so it goes with the last of them.
+            names = index.files_in(dirname)
+            if names - {MANIFEST_FNAME} or index.subdirs_of(dirname):
+                continue
+            try:
+                if MANIFEST_FNAME in names:
+                    os.remove(f'{dirname}/{MANIFEST_FNAME}')
+                os.rmdir(dirname)
+                index.remove_dir(dirname)
+                logging.info(f"Deleted empty directory: {dirname}")
+            except OSError:
+                # something was written into it in the meantime.
+                index.invalidate(dirname)
+
+    # runs one step: refreshes the candidate list if needed and deletes at most one batch
+    # of files whose grace period is over. safe to call from any thread.
+    def collect(self, now=None):
+        if not self.run_lock.acquire(blocking=False):
+            return 0
+
+        try:
+            now = now if now is not None else time.time()
+
+            with self.lock:
+                notebook_file = self.notebook_file
+                desired = self.desired
+                dirty = self.dirty
+                self.dirty = False
+
+            if notebook_file is None:
+                return 0
+
+            if dirty:
+                orphans = self._find_orphans(notebook_file, desired)
+                with self.lock:
+                    if notebook_file is not self.notebook_file:
+                        return 0
+                    self.candidates = {path: self.candidates.get(path, now) for path in orphans}
+
+            with self.lock:
+                expired = [path for path, since in self.candidates.items() if now - since >= self.grace_sec and path not in self.desired]
+                expired.sort()
+                batch = expired[:self.batch_size]
+
+            index = notebook_file.audio_index
+            recycle_bin = self.get_recycle_bin()
+            touched_dirs = set()
+            deleted = 0
+            for file_path in batch:
+                try:
+                    if is_temp_name(file_path):
+                        os.remove(file_path)
+                        logging.info(f"Deleted: {file_path}")
+                    else:
+                        recycle_bin.recycle(file_path)
+                        logging.info(f"Recycled: {file_path}")
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logging.error(f"Error: {file_path} : {e.strerror}")
+                    continue
+                else:
+                    deleted += 1
+                index.remove(file_path)
+                touched_dirs.add(file_path.rpartition('/')[0])
+                with self.lock:
+                    self.candidates.pop(file_path, None)
+
+            if touched_dirs:
+                self._remove_empty_dirs(notebook_file, touched_dirs)
+
+            self.deleted_count += deleted
+            return deleted
+        finally:
+            self.run_lock.release()
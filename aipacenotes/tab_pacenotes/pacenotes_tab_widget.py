@@ -1,4 +1,4 @@
-import os
+import threading
 import webbrowser
 import pprint
 import logging
@@ -24,14 +24,17 @@ from PyQt6.QtWidgets import (
 )
 
 import aipacenotes.util
-from aipacenotes.concurrency import TaskManager, TimerThread
+from aipacenotes.concurrency import AsyncEngine, FileWatcher, TaskManager, TimerThread
 from aipacenotes import client as aip_client
+from .job_journal import JobJournal
+from .orphan_collector import OrphanCollector
 from .pacenotes_table import NotebookTable, NotebookTableModel
 from .pacenotes_tree_widget import PacenotesTreeWidget
 from .update_jobs import (
     UpdateJobsStore,
     UpdateJob,
     UPDATE_JOB_STATUS_UPDATING,
+    UPDATE_JOB_STATUS_RETRYING,
     UPDATE_JOB_STATUS_SUCCESS,
     UPDATE_JOB_STATUS_ERROR,
 )
@@ -55,6 +58,7 @@ class ClickableLabel(QLabel):
 class PacenotesTabWidget(QWidget):
 
     pacenote_updated = pyqtSignal()
+    pacenotes_refreshed = pyqtSignal(object)
     job_run_finished = pyqtSignal(UpdateJob)
     tree_refreshed = pyqtSignal()
     translate_finished = pyqtSignal()
@@ -83,15 +87,27 @@ class PacenotesTabWidget(QWidget):
         self.splitter = QSplitter(Qt.Orientation.Horizontal)
 
         self.task_manager = TaskManager(10)
-        self.timer_thread = TimerThread(0.5)
+        # audio generation runs here, so it isn't limited by the task manager's threads.
+        self.async_engine = AsyncEngine(self.settings_manager.get_max_concurrent_requests())
+
+        # refreshes are driven by file changes. the timer only does job housekeeping.
+        self.timer_thread = TimerThread(1.0)
         self.timer_thread.timeout.connect(self.on_timer_timeout)
+        self.file_watcher = FileWatcher()
+        self.file_watcher.changed.connect(self.on_watched_files_changed)
+
+        self.refresh_lock = threading.Lock()
+        self.refresh_running = False
+        self.refresh_pending = False
 
         self.job_run_finished.connect(self.on_job_run_finished)
+        self.pacenotes_refreshed.connect(self.on_pacenotes_refreshed)
         self.tree_refreshed.connect(self.on_tree_refreshed)
         self.translate_finished.connect(self.on_translate_finished)
 
         self.tree = PacenotesTreeWidget(self.settings_manager)
         self.tree.notebookSelectionChanged.connect(self.on_tree_notebook_selection_changed)
+        self.tree.regen_requested.connect(self.on_tree_regen_requested)
 
         self.btn_refresh_notebook = QPushButton("Refresh Tree")
         self.btn_refresh_notebook.setFixedWidth(90)
@@ -150,6 +166,7 @@ class PacenotesTabWidget(QWidget):
         self.notebook_table.setColumnWidth(4, 150)
         self.notebook_table.setColumnWidth(5, 250)
         self.notebook_table.play_clicked.connect(self.play_audio)
+        self.notebook_table.regen_requested.connect(self.on_regen_requested)
         self.update_notebook_info_label()
 
         layout = QVBoxLayout()
@@ -174,7 +191,9 @@ class PacenotesTabWidget(QWidget):
         right_layout.addLayout(prog_layout)
         self.splitter.addWidget(right_pane)
 
-        self.update_jobs_store = UpdateJobsStore(self.settings_manager)
+        self.job_journal = JobJournal(self.settings_manager.get_jobs_journal_fname())
+        self.update_jobs_store = UpdateJobsStore(self.settings_manager, self.job_journal)
+        self.orphan_collector = OrphanCollector(self.update_jobs_store.recycle_bin)
 
 
         layout = QVBoxLayout()
@@ -222,22 +241,103 @@ class PacenotesTabWidget(QWidget):
         self.tree.populate()
         self.tree_refreshed.emit()
         # self.tree.select_default()
+        self.update_watched_paths()
+        self.async_engine.start()
+        self.async_engine.warm_up([aip_client.mkurl('/')])
+        self.task_manager.submit(self.resume_jobs)
         self.timer_thread.start()
+        self.file_watcher.start()
+
+    # picks generation back up where the last run left off, without waiting for the
+    # notebook to be selected and refreshed.
+    def resume_jobs(self):
+        resumed = self.update_jobs_store.resume(self.tree.rally_scanner.notebook_file)
+        if resumed > 0:
+            logging.info(f"resuming {resumed} jobs from the job journal")
+            self.submit_pending_jobs()
 
     def on_tree_notebook_selection_changed(self, notebook_file):
+        # the index wasn't kept up to date while the notebook wasn't being watched.
+        notebook_file.audio_index.invalidate()
+        notebook_file.invalidate_voice_manifests()
         self.notebook_table_model.setNotebookFile(notebook_file)
-        self.notebook_table_model.layoutChanged.emit()
         self.update_notebook_info_label()
         self.refresh_pacenotes_table_progress()
+        self.update_watched_paths()
+        self.request_refresh()
+
+    def update_watched_paths(self):
+        paths = list(self.settings_manager.watched_fnames())
+        notebook_file = self.notebook_table_model.notebook_file
+        if notebook_file:
+            paths.append(notebook_file.fname)
+            paths.append(notebook_file.pacenotes_dir())
+        self.file_watcher.set_paths(paths)
+
+    def on_watched_files_changed(self, paths):
+        settings_fnames = set(aipacenotes.util.normalize_path(fname) for fname in self.settings_manager.watched_fnames())
+        settings_changed = any(path in settings_fnames for path in paths)
+
+        notebook_changed = False
+        notebook_file = self.notebook_table_model.notebook_file
+        if notebook_file:
+            notebook_changed = notebook_file.fname in paths
+            # generating audio changes the files too, but those changes are already known.
+            if notebook_file.apply_external_changes(paths):
+                notebook_changed = True
+                self.orphan_collector.mark_dirty()
+
+        def _reload_settings_files():
+            logging.info("voice or static pacenotes files changed, reloading")
+            self.settings_manager.reload_watched_files()
+            self.request_refresh()
+
+        if settings_changed:
+            self.task_manager.submit(_reload_settings_files)
+        elif notebook_changed:
+            self.request_refresh()
+
+    # coalesces refresh requests so at most one refresh runs at a time, plus one queued.
+    def request_refresh(self):
+        if self.translate_in_progress:
+            return
+
+        with self.refresh_lock:
+            if self.refresh_running:
+                self.refresh_pending = True
+                return
+            self.refresh_running = True
+
+        def _refresh_loop():
+            try:
+                while True:
+                    with self.refresh_lock:
+                        self.refresh_pending = False
+                    self.refresh_pacenotes()
+                    with self.refresh_lock:
+                        if not self.refresh_pending:
+                            self.refresh_running = False
+                            return
+            except Exception:
+                with self.refresh_lock:
+                    self.refresh_running = False
+                raise
+
+        self.task_manager.submit(_refresh_loop)
 
     def update_notebook_info_label(self):
         self.notebook_info_label.setText(f"# of pacenotes: {self.notebook_table_model.rowCount()}")
+        notebook_file = self.notebook_table_model.notebook_file
+        if notebook_file:
+            self.notebook_info_label.setToolTip(f"notebook reloads: {notebook_file.load_stats_str()}")
+        else:
+            self.notebook_info_label.setToolTip("")
 
     def update_jobs_info_label(self):
         counts = [[k,v] for k,v in self.update_jobs_store.count_by_status().items()]
         counts.sort(key=lambda pair: pair[0])
         count_str = [f"{cnt[0]}={cnt[1]}" for cnt in counts]
-        self.jobs_info_label.setText(f"# of jobs: {' / '.join(count_str)}")
+        self.jobs_info_label.setText(f"# of jobs: {' / '.join(count_str)} | {self.async_engine.status_str()}")
 
     def play_audio(self, row):
         def _play(fname):
@@ -248,23 +348,67 @@ class PacenotesTabWidget(QWidget):
             sd.play(data, samplerate)
             sd.wait()
 
-        notebook_file = self.notebook_table_model.notebook_file
-        notebook = notebook_file.notebook()
-        if notebook:
-            pacenote = notebook.pacenotes()[row]
-            if pacenote.note_file_exists():
-                self.task_manager.submit(_play, pacenote.note_abs_path())
+        pacenote = self.notebook_table_model.pacenote_at(row)
+        if pacenote:
+            # the codriver being listened to is the one whose audio is generated first.
+            self.update_jobs_store.set_preferred_codriver(pacenote.codriver_name())
+        if pacenote and pacenote.note_file_exists():
+            self.task_manager.submit(_play, pacenote.note_abs_path())
+
+    def confirm_regen(self, what):
+        dialog = QMessageBox()
+        dialog.setWindowTitle("Re-generate audio")
+        dialog.setText(f"Re-generate the audio for {what}?\nThe current audio files are deleted.")
+        dialog.setStandardButtons(QMessageBox.StandardButton.Ok | QMessageBox.StandardButton.Cancel)
+        return dialog.exec() == QMessageBox.StandardButton.Ok
+
+    def on_regen_requested(self, pacenotes):
+        if not pacenotes:
+            return
+        if len(pacenotes) > 1 and not self.confirm_regen(f"{len(pacenotes)} pacenotes"):
+            return
+        self.task_manager.submit(self.regenerate_pacenotes, pacenotes)
+
+    def on_tree_regen_requested(self, notebook_file):
+        def _regenerate_notebook():
+            notebook_file.load()
+            notebook = notebook_file.notebook()
+            if notebook:
+                self.regenerate_pacenotes(notebook.pacenotes())
+
+        if self.confirm_regen(f"every pacenote in '{notebook_file.basenameNoExt()}'"):
+            self.task_manager.submit(_regenerate_notebook)
+
+    # deletes the pacenotes' audio and submits their jobs straight away, ahead of anything
+    # that isn't a forced re-generate, rather than waiting for the next refresh to notice.
+    def regenerate_pacenotes(self, pacenotes):
+        by_notebook_file = {}
+        for pacenote in pacenotes:
+            by_notebook_file.setdefault(pacenote.notebook.notebook_file, []).append(pacenote)
+
+        for notebook_file, group in by_notebook_file.items():
+            notebook_file.force_regen(group)
+            added = 0
+            for pacenote in group:
+                if pacenote.needs_update() and self.update_jobs_store.add_job(pacenote):
+                    added += 1
+            logging.info(f"re-generating {added} pacenotes of {notebook_file}")
+
+        self.submit_pending_jobs()
+
+        for notebook_file in by_notebook_file:
+            self.pacenotes_refreshed.emit(notebook_file)
 
     def on_btn_refresh_notebook_pressed(self):
         def _special_button_refresh():
             self.settings_manager.load()
-            self.tree.clear()
             self.tree.populate()
             self.tree_refreshed.emit()
-            self.notebook_table_model.setNotebookFile(None)
-            self.notebook_table_model.layoutChanged.emit()
-            self.update_notebook_info_label()
+            self.update_watched_paths()
 
+        self.notebook_table_model.setNotebookFile(None)
+        self.update_notebook_info_label()
+        self.refresh_pacenotes_table_progress()
         self.task_manager.submit(_special_button_refresh)
 
     def refresh_pacenotes(self):
@@ -273,34 +417,37 @@ class PacenotesTabWidget(QWidget):
         if not notebook_file:
             return
 
-        notebook_file.load()
+        if notebook_file.load():
+            logging.debug(f"reloaded notebook {notebook_file} | {notebook_file.load_stats_str()}")
         notebook = notebook_file.notebook()
 
         for pacenote in notebook.pacenotes():
             if pacenote.needs_update():
-                job = self.update_jobs_store.add_job(pacenote)
+                self.update_jobs_store.add_job(pacenote)
                 # self.update_jobs_store.print()
-                self.jobs_model.layoutChanged.emit()
-                self.update_jobs_info_label()
+        self.update_jobs_store.supersede_slots(notebook_file.fname, notebook.pacenotes())
 
-                def _run_job(job):
-                    job.run(self.job_run_finished)
-
-                if job:
-                    self.task_manager.submit(_run_job, job)
-
-        self.refresh_pacenotes_table_progress()
-        self.refresh_jobs_table_progress()
+        self.submit_pending_jobs()
 
         self.update_jobs_store.update_job_time_agos()
         self.update_jobs_store.prune()
-        self.delete_orphaned_files(notebook_file)
-        self.jobs_model.layoutChanged.emit()
-        self.notebook_table_model.setNotebookFile(notebook_file)
-        self.notebook_table_model.layoutChanged.emit()
+        self.orphan_collector.set_desired(notebook_file)
+        self.task_manager.gc_finished()
+
+        # the table models are only touched on the gui thread.
+        self.pacenotes_refreshed.emit(notebook_file)
+
+    def submit_pending_jobs(self):
+        for batch in self.update_jobs_store.take_batches():
+            self.async_engine.submit(batch.run_async(self.async_engine, self.job_run_finished))
+
+    def on_pacenotes_refreshed(self, notebook_file):
+        self.notebook_table_model.sync(notebook_file)
+        self.jobs_model.sync()
         self.update_notebook_info_label()
         self.update_jobs_info_label()
-        self.task_manager.gc_finished()
+        self.refresh_pacenotes_table_progress()
+        self.refresh_jobs_table_progress()
 
     def refresh_pacenotes_table_progress(self):
         segments = []
@@ -308,17 +455,12 @@ class PacenotesTabWidget(QWidget):
         def clr_fn(pacenote):
             return pacenote.note_file_exists() and Qt.GlobalColor.green or Qt.GlobalColor.red
 
-        notebook_file = self.notebook_table_model.notebook_file
-        notebook = notebook_file.notebook()
-        if notebook:
-            for pacenote in notebook.pacenotes():
-                if len(segments) == 0:
-                    segments.append([0, clr_fn(pacenote)])
-
-                if segments[-1][1] == pacenote.note_file_exists():
-                    segments[-1][0] += 1
-                else:
-                    segments.append([1, clr_fn(pacenote)])
+        for pacenote in self.notebook_table_model.pacenotes:
+            color = clr_fn(pacenote)
+            if segments and segments[-1][1] == color:
+                segments[-1][0] += 1
+            else:
+                segments.append([1, color])
 
         self.pacenotes_progress_bar.set_segments(segments)
 
@@ -330,69 +472,57 @@ class PacenotesTabWidget(QWidget):
                 return Qt.GlobalColor.green
             elif job.status() == UPDATE_JOB_STATUS_UPDATING:
                 return Qt.GlobalColor.cyan
+            elif job.status() == UPDATE_JOB_STATUS_RETRYING:
+                return Qt.GlobalColor.yellow
             elif job.status() == UPDATE_JOB_STATUS_ERROR:
                 return Qt.GlobalColor.red
             else:
                 return Qt.GlobalColor.gray
 
-        for job in self.update_jobs_store.jobs:
-            if len(segments) == 0:
-                segments.append([0, clr_fn(job)])
-
-            if segments[-1][1] == job.status():
+        for job in self.jobs_model.jobs:
+            color = clr_fn(job)
+            if segments and segments[-1][1] == color:
                 segments[-1][0] += 1
             else:
-                segments.append([1, clr_fn(job)])
+                segments.append([1, color])
 
         self.jobs_progress_bar.set_segments(segments)
 
-    def delete_orphaned_files(self, notebook_file):
-        notebook = notebook_file.notebook()
-
-        desired_files = set()
-
-        for pacenote in notebook.pacenotes():
-            desired_files.add(pacenote.note_abs_path())
-
-        all_files = set()
-        for root, dirs, files in os.walk(notebook.pacenotes_dir()):
-            for file in files:
-                if file.endswith('.ogg'):
-                    full_path = os.path.join(root, file)
-                    all_files.add(aipacenotes.util.normalize_path(os.path.abspath(full_path)))
-
-        files_to_delete = all_files - desired_files
-
-        for file_path in files_to_delete:
-            try:
-                os.remove(file_path)
-                logging.info(f"Deleted: {file_path}")
-            except OSError as e:
-                logging.error(f"Error: {file_path} : {e.strerror}")
+    def on_job_run_finished(self, job):
+        self.on_pacenotes_refreshed(job.pacenote.notebook.notebook_file)
+        # the refresh that saw the voice change found this job still running, so it's up
+        # to the next one to queue its pacenote again.
+        if job.status() == UPDATE_JOB_STATUS_SUCCESS and job.voice_changed():
+            self.request_refresh()
 
+    def on_tree_refreshed(self):
+        self.tree.expandAll()
 
-        # if self.jobs_model.rowCount() == 0:
-        for root, dirs, files in os.walk(notebook.pacenotes_dir(), topdown=False):
-            for name in dirs:
-                dir_path = os.path.join(root, name)
-                if not os.listdir(dir_path):  # Check if the directory is empty
-                    os.rmdir(dir_path)
-                    logging.info(f"Deleted empty directory: {dir_path}")
+    def on_timer_timeout(self):
+        due_count = self.update_jobs_store.take_due_retries()
+        due_count += self.update_jobs_store.take_settled_jobs()
+        if due_count > 0:
+            self.submit_pending_jobs()
 
-    def on_job_run_finished(self, job):
-        self.jobs_model.layoutChanged.emit()
-        self.notebook_table_model.layoutChanged.emit()
-        self.update_notebook_info_label()
+        self.update_jobs_store.update_job_time_agos()
+        pruned_count = self.update_jobs_store.prune()
+        self.jobs_model.sync()
         self.update_jobs_info_label()
-        self.refresh_pacenotes_table_progress()
         self.refresh_jobs_table_progress()
+        self.task_manager.gc_finished()
 
-    def on_tree_refreshed(self):
-        self.tree.expandAll()
+        if self.orphan_collector.has_work():
+            self.task_manager.submit(self.orphan_collector.collect)
 
-    def on_timer_timeout(self):
-        if not self.translate_in_progress:
-            self.task_manager.submit(self.refresh_pacenotes)
+        if self.job_journal.has_changes():
+            self.task_manager.submit(self.job_journal.flush)
+
+        if self.tree.rally_scanner.index_has_changes():
+            self.task_manager.submit(self.tree.rally_scanner.save_index)
+
+        # pacenotes whose failures have expired need a refresh to be retried.
+        if pruned_count > 0:
+            self.request_refresh()
 
     def perform_translate(self):
         notebook_file = self.notebook_table_model.notebook_file
@@ -436,13 +566,14 @@ class PacenotesTabWidget(QWidget):
     def on_translate_finished(self):
         dialog = QMessageBox()
         dialog.setWindowTitle("Translation")
-        dialog.setText("Translation completed.\nThe notebook file was saved and a backup file was be created.\n(check logs/terminal for path).")
+        dialog.setText("Translation completed.\nThe notebook file was saved and the previous version was backed up\nto the backups folder next to it.")
         dialog.setStandardButtons(QMessageBox.StandardButton.Ok)
         retval = dialog.exec()
 
         self.btn_translate.setEnabled(True)
         self.btn_translate.setText("Translate")
         self.translate_in_progress = False
+        self.request_refresh()
 
     def on_btn_translate_clicked(self):
         if not self.notebook_table_model.notebook_file:
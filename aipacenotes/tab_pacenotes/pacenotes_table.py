@@ -1,5 +1,6 @@
 from functools import partial
 import aipacenotes.util
+from .row_diff import sync_rows
 
 from PyQt6.QtCore import (
     Qt,
@@ -67,12 +68,14 @@ class PlayButtonDelegate(QStyledItemDelegate):
 
 class NotebookTable(QTableView):
     play_clicked = pyqtSignal(int)
+    # a list of pacenotes whose audio should be generated again.
+    regen_requested = pyqtSignal(object)
 
     def __init__(self):
         super().__init__()
         self.verticalHeader().setVisible(False)
-        # self.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
-        self.setSelectionMode(QAbstractItemView.SelectionMode.NoSelection)
+        self.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
         self.setFocusPolicy(Qt.FocusPolicy.NoFocus)
 
         self.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
@@ -106,6 +109,18 @@ class NotebookTable(QTableView):
         menu.addAction("Copy audio file path", partial(self.context_menu_action_copy_audio_file_path, row))
         menu.addAction("Force re-generate audio file", partial(self.context_menu_action_force_regen, row))
 
+        pacenote = self.get_pacenote_at_row(row)
+        if pacenote:
+            menu.addSeparator()
+            selected_rows = self.selected_rows(row)
+            if len(selected_rows) > 1:
+                menu.addAction(f"Re-generate {len(selected_rows)} selected", partial(self.context_menu_action_regen_rows, selected_rows))
+            codriver_name = pacenote.codriver_name()
+            menu.addAction(f"Re-generate codriver '{codriver_name}'", partial(self.context_menu_action_regen_where, lambda pn: pn.codriver_name() == codriver_name))
+            language = pacenote.language()
+            menu.addAction(f"Re-generate language '{language}'", partial(self.context_menu_action_regen_where, lambda pn: pn.language() == language))
+            menu.addAction("Re-generate whole notebook", partial(self.context_menu_action_regen_where, lambda pn: True))
+
         menuSize = menu.sizeHint()
         globalPos.setY(globalPos.y() + int(menuSize.height()/2))
         menu.exec(globalPos)
@@ -123,15 +138,24 @@ class NotebookTable(QTableView):
     def context_menu_action_force_regen(self, row):
         pacenote = self.get_pacenote_at_row(row)
         if pacenote:
-            pacenote.delete_audio_file()
+            self.regen_requested.emit([pacenote])
+
+    def context_menu_action_regen_rows(self, rows):
+        pacenotes = [self.get_pacenote_at_row(row) for row in rows]
+        self.regen_requested.emit([pacenote for pacenote in pacenotes if pacenote])
+
+    def context_menu_action_regen_where(self, fn):
+        self.regen_requested.emit([pacenote for pacenote in self.model().pacenotes if fn(pacenote)])
+
+    # the selected rows, or just the clicked one if it isn't part of the selection.
+    def selected_rows(self, clicked_row):
+        rows = sorted(index.row() for index in self.selectionModel().selectedRows())
+        if clicked_row not in rows:
+            return [clicked_row]
+        return rows
 
     def get_pacenote_at_row(self, row):
-        notebook_file = self.model().notebook_file
-        notebook = notebook_file.notebook()
-        if notebook:
-            return notebook.pacenotes()[row]
-        else:
-            return None
+        return self.model().pacenote_at(row)
 
     def playClicked(self, row):
         # print(f"Play button clicked on row {row}")
@@ -143,20 +167,48 @@ class NotebookTableModel(QAbstractTableModel):
     def __init__(self):
         super(NotebookTableModel, self).__init__()
         self.notebook_file = None
-        self.notebook = None
+        self.pacenotes = []
+        self.fingerprints = []
+
+    def _current_pacenotes(self):
+        if self.notebook_file is None:
+            return []
+        notebook = self.notebook_file.notebook()
+        if notebook is None:
+            return []
+        return notebook.pacenotes()
+
+    def row_key(self, pacenote):
+        return (pacenote.notebook.name(), pacenote.codriver_name(), pacenote.name())
+
+    # everything the row's cells are drawn from.
+    def row_fingerprint(self, pacenote):
+        return (pacenote.note(), pacenote.language(), pacenote.voice(), pacenote.note_basename(), pacenote.note_file_exists())
 
     def setNotebookFile(self, notebook_file):
+        self.beginResetModel()
         self.notebook_file = notebook_file
-        if self.notebook_file is None:
-            self.notebook = None
-        else:
-            self.notebook = self.notebook_file.notebook()
+        self.pacenotes = list(self._current_pacenotes())
+        self.fingerprints = [self.row_fingerprint(pn) for pn in self.pacenotes]
+        self.endResetModel()
+
+    # diffs the notebook's current pacenotes against the displayed rows.
+    def sync(self, notebook_file):
+        if notebook_file is not self.notebook_file:
+            return 0
+        new_pacenotes = list(self._current_pacenotes())
+        new_fingerprints = [self.row_fingerprint(pn) for pn in new_pacenotes]
+        return sync_rows(self, self.pacenotes, self.fingerprints, new_pacenotes, new_fingerprints, self.row_key)
+
+    def pacenote_at(self, row):
+        if 0 <= row < len(self.pacenotes):
+            return self.pacenotes[row]
+        return None
 
     def rowCount(self, parent=None):
-        if self.notebook:
-            return len(self.notebook)
-        else:
+        if parent is not None and parent.isValid():
             return 0
+        return len(self.pacenotes)
 
     def columnCount(self, parent=None):
         return len(self.headers)
@@ -166,8 +218,8 @@ class NotebookTableModel(QAbstractTableModel):
             return None
 
         if role == Qt.ItemDataRole.DisplayRole:
-            if self.notebook:
-                pacenote = self.notebook.pacenotes()[index.row()]
+            pacenote = self.pacenote_at(index.row())
+            if pacenote:
                 if index.column() == 0:
                     if pacenote.note_file_exists():
                         return 'yes'
@@ -187,8 +239,8 @@ class NotebookTableModel(QAbstractTableModel):
                 return None
 
         if role == Qt.ItemDataRole.BackgroundRole:
-            if self.notebook:
-                pacenote = self.notebook.pacenotes()[index.row()]
+            pacenote = self.pacenote_at(index.row())
+            if pacenote:
                 if index.column() == 0:
                     if pacenote.note_file_exists():
                         return QColor(Qt.GlobalColor.green)
@@ -196,16 +248,14 @@ class NotebookTableModel(QAbstractTableModel):
                         return QColor(Qt.GlobalColor.red)
 
         if role == Qt.ItemDataRole.FontRole:
-            if self.notebook:
-                pacenote = self.notebook.pacenotes()[index.row()]
+            if self.pacenotes:
                 if index.column() == 0:
                     font = QFont()
                     font.setBold(True)
                     return font
 
         if role == Qt.ItemDataRole.TextAlignmentRole:
-            if self.notebook:
-                pacenote = self.notebook.pacenotes()[index.row()]
+            if self.pacenotes:
                 if index.column() == 0:
                     return Qt.AlignmentFlag.AlignCenter
 
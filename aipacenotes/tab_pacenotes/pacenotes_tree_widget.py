@@ -1,4 +1,5 @@
 import os
+import threading
 from functools import partial
 
 from PyQt6.QtWidgets import (
@@ -12,12 +13,19 @@ from PyQt6.QtCore import (
     pyqtSignal,
 )
 
-from .rally_file_scanner import RallyFileScanner
+from .rally_file_scanner import RallyFileScanner, SearchPath
 from .rally_file import NotebookFile
 import aipacenotes.util
 
 class PacenotesTreeWidget(QTreeWidget):
     notebookSelectionChanged = pyqtSignal(NotebookFile)
+    regen_requested = pyqtSignal(NotebookFile)
+
+    # scanning happens on a background thread. these carry its results to the gui thread.
+    scan_started = pyqtSignal(object)
+    notebook_found = pyqtSignal(object, object)
+    notebook_removed = pyqtSignal(object, object)
+    scan_finished = pyqtSignal()
 
     def __init__(self, settings_manager):
         super().__init__()
@@ -27,23 +35,67 @@ class PacenotesTreeWidget(QTreeWidget):
         self.itemClicked.connect(self.on_tree_item_clicked)
         # self.currentItemChanged.connect(self.on_current_item_changed)
 
-    def populate(self):
-        rally_scanner = RallyFileScanner(self.settings_manager)
-        rally_scanner.scan()
-
-        root_items = []
-        for search_path in rally_scanner.search_paths:
-            item_search_path = QTreeWidgetItem([str(search_path)])
-            item_search_path.setData(0, Qt.ItemDataRole.UserRole, search_path)
-            root_items.append(item_search_path)
+        self.search_path_items = {}
+        self.scan_started.connect(self.on_scan_started)
+        self.notebook_found.connect(self.on_notebook_found)
+        self.notebook_removed.connect(self.on_notebook_removed)
+        self.scan_finished.connect(self.on_scan_finished)
 
-            for rally_file in search_path.rally_files:
-                item_text = str(rally_file).removeprefix(str(search_path))
-                child_rally_file = QTreeWidgetItem([item_text])
-                child_rally_file.setData(0, Qt.ItemDataRole.UserRole, rally_file)
-                item_search_path.addChild(child_rally_file)
+        # kept across populates so notebook files, and their parsed data, are reused.
+        self.rally_scanner = RallyFileScanner(self.settings_manager)
+        self.scan_lock = threading.Lock()
 
-        self.insertTopLevelItems(0, root_items)
+    # safe to call from any thread. the tree is first filled from the persisted scan index,
+    # then corrected as the background scan finds or loses notebooks.
+    def populate(self):
+        def _scan():
+            with self.scan_lock:
+                search_paths = self.settings_manager.get_pacenotes_search_paths()
+                self.scan_started.emit(search_paths)
+                self.rally_scanner.scan_cached(on_found=self.notebook_found.emit)
+                self.scan_finished.emit()
+                self.rally_scanner.scan(on_found=self.notebook_found.emit, on_removed=self.notebook_removed.emit)
+                self.scan_finished.emit()
+
+        threading.Thread(target=_scan, daemon=True).start()
+
+    def on_scan_started(self, search_paths):
+        self.clear()
+        self.search_path_items = {}
+
+        for search_path in search_paths:
+            sp = SearchPath(search_path)
+            item_search_path = QTreeWidgetItem([str(sp)])
+            item_search_path.setData(0, Qt.ItemDataRole.UserRole, sp)
+            self.addTopLevelItem(item_search_path)
+            item_search_path.setExpanded(True)
+            self.search_path_items[search_path] = item_search_path
+
+    def on_notebook_found(self, search_path, rally_file):
+        item_search_path = self.search_path_items.get(search_path.fname)
+        if item_search_path is None:
+            return
+
+        item_text = str(rally_file).removeprefix(str(search_path))
+        child_rally_file = QTreeWidgetItem([item_text])
+        child_rally_file.setData(0, Qt.ItemDataRole.UserRole, rally_file)
+        child_rally_file.setToolTip(0, rally_file.metadata_str())
+        item_search_path.addChild(child_rally_file)
+
+    def on_notebook_removed(self, search_path, rally_file):
+        item_search_path = self.search_path_items.get(search_path.fname)
+        if item_search_path is None:
+            return
+
+        for i in range(item_search_path.childCount()):
+            child = item_search_path.child(i)
+            if child.data(0, Qt.ItemDataRole.UserRole) is rally_file:
+                item_search_path.removeChild(child)
+                break
+
+    def on_scan_finished(self):
+        for item_search_path in self.search_path_items.values():
+            item_search_path.sortChildren(0, Qt.SortOrder.AscendingOrder)
 
     def on_tree_item_clicked(self, current_item):
         item_data = current_item.data(0, Qt.ItemDataRole.UserRole)
@@ -73,4 +125,8 @@ class PacenotesTreeWidget(QTreeWidget):
             fn = partial(aipacenotes.util.open_file_explorer, full_path)
             open_action.triggered.connect(fn)
 
+            if isinstance(user_data, NotebookFile):
+                regen_action = context_menu.addAction("Re-generate all audio")
+                regen_action.triggered.connect(partial(self.regen_requested.emit, user_data))
+
             context_menu.exec(event.globalPos())
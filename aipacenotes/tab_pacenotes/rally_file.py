@@ -1,18 +1,106 @@
-import copy
-import shutil
+import hashlib
 import time
 import json
 import logging
 import os
 import pathlib
 import re
+import threading
 
-import aipacenotes.util
+import numpy as np
 
+import aipacenotes.util
+from .audio_index import AudioIndex, is_temp_name
+from .voice_manifest import VoiceManifest, MANIFEST_FNAME
+
+NOTE_HASH_MODULUS = 2147483647
+
+# the game mod names audio files by a hash of the note text: `h = (h * 33 + c) % 2147483647`
+# over the lowercase hex digits of the utf-8 bytes. each byte is two hex digits, so it is
+# folded in as a single `h * 33**2 + term` step with the term precomputed per byte value.
+_NOTE_HASH_BYTE_TERMS = [ord(f'{b:02x}'[0]) * 33 + ord(f'{b:02x}'[1]) for b in range(256)]
+_NOTE_HASH_STEP = 33 * 33
+_NOTE_HASH_CACHE_MAX = 100000
+
+_note_hash_cache = {}
+_note_hash_lock = threading.Lock()
+
+def _note_hash_uncached(note_text):
+    hash_value = 0
+    terms = _NOTE_HASH_BYTE_TERMS
+    for byte in note_text.encode('utf-8'):
+        hash_value = (hash_value * _NOTE_HASH_STEP + terms[byte]) % NOTE_HASH_MODULUS
+    return hash_value
+
+def _note_hashes_vectorized(note_texts):
+    encoded = [text.encode('utf-8') for text in note_texts]
+    max_len = max(len(b) for b in encoded)
+
+    # right-align every note so leading padding (term 0) leaves the hash at 0.
+    terms = np.zeros((len(encoded), max_len), dtype=np.int64)
+    term_table = np.array(_NOTE_HASH_BYTE_TERMS, dtype=np.int64)
+    for i, b in enumerate(encoded):
+        if b:
+            terms[i, max_len - len(b):] = term_table[np.frombuffer(b, dtype=np.uint8)]
+
+    # values stay below 2**31 * 1089 + 2**13, well inside int64.
+    hashes = np.zeros(len(encoded), dtype=np.int64)
+    for col in range(max_len):
+        hashes = (hashes * _NOTE_HASH_STEP + terms[:, col]) % NOTE_HASH_MODULUS
+
+    return [int(h) for h in hashes]
+
+def _note_hash_cache_put(pairs):
+    with _note_hash_lock:
+        if len(_note_hash_cache) > _NOTE_HASH_CACHE_MAX:
+            _note_hash_cache.clear()
+        _note_hash_cache.update(pairs)
+
+def note_hash(note_text):
+    hash_value = _note_hash_cache.get(note_text)
+    if hash_value is None:
+        hash_value = _note_hash_uncached(note_text)
+        _note_hash_cache_put({note_text: hash_value})
+    return hash_value
+
+# hashes many notes at once. uncached texts are hashed together with numpy.
+def note_hashes(note_texts):
+    note_texts = list(note_texts)
+    missing = [text for text in set(note_texts) if text not in _note_hash_cache]
+
+    if len(missing) > 16:
+        _note_hash_cache_put(zip(missing, _note_hashes_vectorized(missing)))
+
+    return [note_hash(text) for text in note_texts]
+
+# a view of one pacenote as voiced by one codriver. the pacenote and codriver dicts are
+# shared with the notebook data; only the derived fields are stored per instance.
 class Pacenote:
-    def __init__(self, notebook, data):
+    __slots__ = (
+        'notebook',
+        'source',
+        'codriver_index',
+        '_codriver',
+        '_language',
+        '_note',
+        '_note_hash',
+        '_note_abs_path',
+        'position',
+        'static',
+    )
+
+    def __init__(self, notebook, source, codriver_index, codriver, language, note, position=0, static=False):
         self.notebook = notebook
-        self.data = data
+        self.source = source
+        self.codriver_index = codriver_index
+        # index of the pacenote in the stage, or in the static pacenotes.
+        self.position = position
+        self.static = static
+        self._codriver = codriver
+        self._language = language
+        self._note = note
+        self._note_hash = None
+        self._note_abs_path = None
 
     def __str__(self):
         return f'{self.short_name()} | {self.note_abs_path()}'
@@ -24,19 +112,19 @@ class Pacenote:
         return f'[exist={exist}] {self.clean_codriver_name()} | {self.name()}: {self.note()}'
 
     def name(self):
-        return self.data['name']
+        return self.source['name']
 
     def language(self):
-        return self.data['language']
+        return self._language
 
     def oldId(self):
-        return self.data['oldId']
+        return self.source['oldId']
 
     def note(self):
-        return self.data['note']
+        return self._note
 
     def codriver(self):
-        return self.data['codriver']
+        return self._codriver
 
     def voice(self):
         return self.codriver()['voice']
@@ -45,24 +133,17 @@ class Pacenote:
         return self.codriver()['name']
 
     def note_hash(self):
-        s = self.note()
-        # Convert the string to a bytes object, assuming UTF-8 encoding
-        byte_sequence = s.encode('utf-8')
-
-        # Convert each byte to its hexadecimal representation
-        hex_string = ''.join('{:02x}'.format(byte) for byte in byte_sequence)
-
-        # Calculate the hash value
-        hash_value = 0
-        for hex_char in hex_string:
-            hash_value = (hash_value * 33 + ord(hex_char)) % 2147483647
-        return hash_value
+        if self._note_hash is None:
+            self._note_hash = note_hash(self.note())
+        return self._note_hash
 
     def note_basename(self):
         return f'pacenote_{self.note_hash()}.ogg'
 
     def note_abs_path(self):
-        return aipacenotes.util.normalize_path(os.path.join(self.pacenotes_dir(), self.note_basename()))
+        if self._note_abs_path is None:
+            self._note_abs_path = aipacenotes.util.normalize_path(os.path.join(self.pacenotes_dir(), self.note_basename()))
+        return self._note_abs_path
 
     def clean_codriver_name(self):
         return aipacenotes.util.clean_name_for_path(
@@ -78,26 +159,67 @@ class Pacenote:
         )
         return the_dir
 
+    def audio_index(self):
+        return self.notebook.notebook_file.audio_index
+
     def note_file_exists(self):
-        return os.path.isfile(self.note_abs_path())
+        return self.audio_index().exists(self.note_abs_path())
+
+    def voice_fingerprint(self):
+        return self.notebook.notebook_file.settings_manager.voice_config_fingerprint(self.voice())
+
+    def voice_manifest(self):
+        return self.notebook.notebook_file.voice_manifest(self.pacenotes_dir())
+
+    # the audio file was generated with a different config of this pacenote's voice.
+    def is_voice_stale(self):
+        return self.voice_manifest().is_stale(self.note_basename(), self.voice_fingerprint())
+
+    # `voice_fingerprint` is the one the audio was requested with, which may be older than
+    # the voice's current one.
+    def record_voice(self, voice_fingerprint):
+        self.voice_manifest().record(self.note_basename(), voice_fingerprint)
 
     def needs_update(self):
         file_doesnt_exist = not self.note_file_exists()
+        stale = not file_doesnt_exist and self.is_voice_stale()
         unknown = self.note() == aipacenotes.util.UNKNOWN_PLACEHOLDER
         empty = self.note() == aipacenotes.util.EMPTY_PLACEHOLDER
-        rv = file_doesnt_exist and not unknown and not empty
+        rv = (file_doesnt_exist or stale) and not unknown and not empty
         if rv:
-            logging.info(f"Pacenote.needs_update() {self.short_name()} | file_doesnt_exist={file_doesnt_exist} unknown={unknown} empty={empty} rv={rv}")
+            logging.info(f"Pacenote.needs_update() {self.short_name()} | file_doesnt_exist={file_doesnt_exist} stale={stale} unknown={unknown} empty={empty} rv={rv}")
         return rv
 
     def ensure_pacenotes_dir(self):
         self.notebook.ensure_pacenotes_dir()
         pathlib.Path(self.pacenotes_dir()).mkdir(parents=True, exist_ok=True)
 
-    def write_file(self, data):
+    # hardlinks (or copies) already generated audio out of the audio store.
+    def place_from_store(self, audio_store, key, voice_fingerprint):
         self.ensure_pacenotes_dir()
-        with open(self.note_abs_path(), 'wb') as f:
-            f.write(data)
+        if audio_store.place(key, self.note_abs_path()):
+            self.audio_index().add(self.note_abs_path())
+            self.record_voice(voice_fingerprint)
+            return True
+        return False
+
+    def restore_from_recycle_bin(self, recycle_bin, voice_fingerprint):
+        self.ensure_pacenotes_dir()
+        if recycle_bin.restore(self.note_abs_path()):
+            self.audio_index().add(self.note_abs_path())
+            self.record_voice(voice_fingerprint)
+            return True
+        return False
+
+    # the next job for this pacenote goes to the server instead of reusing any audio.
+    def force_regen(self):
+        self.notebook.notebook_file.force_regen([self])
+
+    def is_force_regen(self):
+        return self.note_abs_path() in self.notebook.notebook_file.force_regen_paths
+
+    def clear_force_regen(self):
+        self.notebook.notebook_file.force_regen_paths.discard(self.note_abs_path())
 
     def delete_audio_file(self):
         file_path = self.note_abs_path()
@@ -106,6 +228,7 @@ class Pacenote:
             logging.info(f"deleted: {file_path}")
         except OSError as e:
             logging.error(f"error: {file_path} : {e.strerror}")
+        self.audio_index().remove(file_path)
 
 class Notebook:
     def __init__(self, notebook_file, data):
@@ -165,29 +288,23 @@ class Notebook:
 
             return rv
 
-        for codriver_data in codrivers:
-            for pacenote_data in self.data['pacenotes']:
-                # for each note language, make a copy of the whole note data.
-                for lang,note_data in pacenote_data['notes'].items():
-                    if codriver_data['language'] == lang:
-                        pn_data_copy = copy.deepcopy(pacenote_data)
-                        pn_data_copy['note'] = concat_note_data(note_data)
-                        pn_data_copy['language'] = lang
-                        pn_data_copy['codriver'] = codriver_data # copy.deepcopy(codriver_data)
-                        pacenote = Pacenote(self, pn_data_copy)
-                        pacenotes.append(pacenote)
-
-
-            for pacenote_data in self.notebook_file.static_pacenotes:
-                # for each note language, make a copy of the whole note data.
-                for lang,note_data in pacenote_data['notes'].items():
-                    if codriver_data['language'] == lang:
-                        pn_data_copy = copy.deepcopy(pacenote_data)
-                        pn_data_copy['note'] = concat_note_data(note_data)
-                        pn_data_copy['language'] = lang
-                        pn_data_copy['codriver'] = codriver_data # copy.deepcopy(codriver_data)
-                        pacenote = Pacenote(self, pn_data_copy)
-                        pacenotes.append(pacenote)
+        for codriver_index, codriver_data in enumerate(codrivers):
+            lang = codriver_data['language']
+
+            for position, pacenote_data in enumerate(self.data['pacenotes']):
+                note_data = pacenote_data['notes'].get(lang)
+                if note_data is not None:
+                    pacenote = Pacenote(self, pacenote_data, codriver_index, codriver_data, lang, concat_note_data(note_data), position)
+                    pacenotes.append(pacenote)
+
+            for position, pacenote_data in enumerate(self.notebook_file.static_pacenotes):
+                note_data = pacenote_data['notes'].get(lang)
+                if note_data is not None:
+                    pacenote = Pacenote(self, pacenote_data, codriver_index, codriver_data, lang, concat_note_data(note_data), position, True)
+                    pacenotes.append(pacenote)
+
+        for pacenote, hash_value in zip(pacenotes, note_hashes(pn.note() for pn in pacenotes)):
+            pacenote._note_hash = hash_value
 
         self._pacenotes = pacenotes
 
@@ -202,13 +319,34 @@ class Notebook:
         pathlib.Path(self.pacenotes_dir()).mkdir(parents=False, exist_ok=True)
 
 class NotebookFile:
+    # a file modified this close to when it was last read may have been written
+    # again within the same mtime tick, so its content is hashed instead of trusting stat.
+    racy_window_sec = 2.0
 
-    def __init__(self, fname, settings_manager):
+    def __init__(self, fname, settings_manager, scan_index=None):
         self.fname = aipacenotes.util.normalize_path(fname)
-        self.ensure_pacenotes_dir()
         self.settings_manager = settings_manager
+        self.scan_index = scan_index
+        self.metadata = {}
         self.static_pacenotes = None
         self.data = None
+        self._notebook = None
+        self.audio_index = AudioIndex()
+        self.force_regen_paths = set()
+        # load() and notebook() are called from the refresh thread and when resuming jobs.
+        self.load_lock = threading.Lock()
+        # codriver dir -> VoiceManifest.
+        self.voice_manifests = {}
+        self.voice_manifests_lock = threading.Lock()
+        self._mission_id = None
+        self._stat_key = None
+        self._content_digest = None
+        self._read_at = 0.0
+        self.load_stats = {
+            'parsed': 0,
+            'skipped_stat': 0,
+            'skipped_content': 0,
+        }
 
     def __str__(self):
         return aipacenotes.util.normalize_path(self.fname)
@@ -236,50 +374,268 @@ class NotebookFile:
     def file_explorer_path(self):
         return self.dirname()
 
+    # returns True when the pacenotes need to be re-expanded, False when neither the file
+    # nor the static pacenotes changed and the existing notebook was kept.
     def load(self):
-        # with open(self.fname) as f:
-        #     self.data = json.load(f)
-
-        f = open(self.fname, "r", encoding= 'utf-8')
-        self.data = json.loads(f.read())
-        f.close()
-
-        self.static_pacenotes = self.settings_manager.get_static_pacenotes()
+        with self.load_lock:
+            return self._load()
+
+    def _load(self):
+        static_changed = False
+        static_pacenotes = self.settings_manager.get_static_pacenotes()
+        if static_pacenotes is not self.static_pacenotes:
+            self.static_pacenotes = static_pacenotes
+            self._notebook = None
+            static_changed = True
+
+        st = os.stat(self.fname)
+        stat_key = (st.st_mtime_ns, st.st_size)
+        is_racy = st.st_mtime >= self._read_at - self.racy_window_sec
+
+        if self.data is not None and stat_key == self._stat_key and not is_racy:
+            self.load_stats['skipped_stat'] += 1
+            return static_changed
+
+        self._read_at = time.time()
+        with open(self.fname, 'rb') as f:
+            raw = f.read()
+        digest = hashlib.sha1(raw).hexdigest()
+        self._stat_key = stat_key
+
+        if self.data is not None and digest == self._content_digest:
+            self.load_stats['skipped_content'] += 1
+            return static_changed
+
+        self.data = json.loads(raw.decode('utf-8'))
+        self._content_digest = digest
+        self._notebook = None
+        self.load_stats['parsed'] += 1
+        self.update_metadata(st)
+        return True
+
+    def update_metadata(self, st):
+        try:
+            mission_id = self.mission_id()
+        except ValueError:
+            mission_id = None
+
+        self.metadata = {
+            'mtime_ns': st.st_mtime_ns,
+            'size': st.st_size,
+            'mission_id': mission_id,
+            'name': self.data.get('name'),
+            'pacenote_count': len(self.data.get('pacenotes', [])),
+        }
+
+        if self.scan_index:
+            self.scan_index.update_notebook_metadata(self)
+
+    def metadata_str(self):
+        parts = []
+        if self.metadata.get('name'):
+            parts.append(f"notebook: {self.metadata['name']}")
+        if self.metadata.get('pacenote_count') is not None:
+            parts.append(f"pacenotes: {self.metadata['pacenote_count']}")
+        if self.metadata.get('mission_id'):
+            parts.append(f"mission: {self.metadata['mission_id']}")
+        return '\n'.join(parts)
+
+    def load_stats_str(self):
+        skipped = self.load_stats['skipped_stat'] + self.load_stats['skipped_content']
+        return f"parsed={self.load_stats['parsed']} skipped={skipped} (stat={self.load_stats['skipped_stat']} content={self.load_stats['skipped_content']})"
+
+    def backups_dir(self):
+        return aipacenotes.util.normalize_path(os.path.join(self.dirname(), 'backups'))
+
+    # backups are named `<basename>.<timestamp>.<sha1>.bak`, so content that's already backed
+    # up is found by its digest instead of being copied again.
+    def list_backups(self):
+        prefix = self.basename() + '.'
+        rv = []
+        try:
+            with os.scandir(self.backups_dir()) as it:
+                for entry in it:
+                    if not (entry.name.startswith(prefix) and entry.name.endswith('.bak')):
+                        continue
+                    parts = entry.name[len(prefix):-len('.bak')].split('.')
+                    if len(parts) != 2 or not parts[0].isdigit():
+                        continue
+                    st = entry.stat()
+                    rv.append({
+                        'path': aipacenotes.util.normalize_path(entry.path),
+                        'timestamp': int(parts[0]),
+                        'digest': parts[1],
+                        'size': st.st_size,
+                        'mtime_ns': st.st_mtime_ns,
+                    })
+        except FileNotFoundError:
+            pass
+        rv.sort(key=lambda b: (b['timestamp'], b['mtime_ns']), reverse=True)
+        return rv
 
+    def backup(self, raw, digest):
+        backups = self.list_backups()
+        for b in backups:
+            if b['digest'] == digest:
+                logging.info(f"backup already exists: {b['path']}")
+                return b['path']
+
+        os.makedirs(self.backups_dir(), exist_ok=True)
+        timestamp = int(time.time())
+        backup_fname = aipacenotes.util.normalize_path(os.path.join(self.backups_dir(), f"{self.basename()}.{timestamp}.{digest}.bak"))
+        aipacenotes.util.atomic_write(backup_fname, raw)
+        logging.info(f"backup created: {backup_fname}")
+        return backup_fname
+
+    # drops the oldest backups once the count, total size or age limit is exceeded.
+    def prune_backups(self):
+        retention = self.settings_manager.get_notebook_backup_retention()
+        max_count = retention['max_count']
+        max_bytes = retention['max_total_mb'] * 1024 * 1024
+        min_timestamp = time.time() - retention['max_age_days'] * 24 * 60 * 60
+
+        total_bytes = 0
+        for i, b in enumerate(self.list_backups()):
+            total_bytes += b['size']
+            if i == 0:
+                continue
+            if i >= max_count or total_bytes > max_bytes or b['timestamp'] < min_timestamp:
+                try:
+                    os.remove(b['path'])
+                    logging.info(f"pruned backup: {b['path']}")
+                except OSError as e:
+                    logging.error(f"couldnt prune backup {b['path']}: {e}")
+
+    # returns True if the file was written, False if it already had this content.
     def save(self):
         try:
-            # Create a backup if the file already exists
-            if os.path.exists(self.fname):
-                timestamp = int(time.time())
-                backup_fname = f"{self.fname}.{timestamp}"
-                shutil.copy(self.fname, backup_fname)
-                print(f"backup created: {backup_fname}")
-
-            # Write new data to the file
-            # with open(self.fname, 'w') as f:
-            #     json.dump(self.data, f)
-
-            f = open(self.fname, 'w', encoding= 'utf-8')
-            i = json.dumps(self.data, indent=4, ensure_ascii=False)
-            f.write(i)
-            f.close()
-
-        except IOError as e:
-            print(f"An error occurred while writing to the file: {e}")
+            new_raw = json.dumps(self.data, indent=4, ensure_ascii=False).encode('utf-8')
+            new_digest = hashlib.sha1(new_raw).hexdigest()
+
+            try:
+                with open(self.fname, 'rb') as f:
+                    old_raw = f.read()
+            except FileNotFoundError:
+                old_raw = None
+
+            if old_raw is not None:
+                old_digest = hashlib.sha1(old_raw).hexdigest()
+                if old_digest == new_digest:
+                    logging.info(f"notebook unchanged, not saving: {self.fname}")
+                    return False
+                self.backup(old_raw, old_digest)
+
+            aipacenotes.util.atomic_write(self.fname, new_raw)
+
+            # what's in memory is what's on disk, so the next load can skip the parse.
+            st = os.stat(self.fname)
+            self._stat_key = (st.st_mtime_ns, st.st_size)
+            self._content_digest = new_digest
+            self._read_at = time.time()
+            self.update_metadata(st)
+
+            self.prune_backups()
+            return True
+
+        except OSError as e:
+            logging.error(f"An error occurred while writing to the file: {e}")
         except TypeError as e:
-            print(f"An error occurred with the data type: {e}")
-        except Exception as e:
-            print(f"An unexpected error occurred: {e}")
+            logging.error(f"An error occurred with the data type: {e}")
+        return False
+
+    def voice_manifest(self, dirname):
+        with self.voice_manifests_lock:
+            manifest = self.voice_manifests.get(dirname)
+            if manifest is None:
+                manifest = VoiceManifest(dirname, self.audio_index)
+                self.voice_manifests[dirname] = manifest
+            return manifest
+
+    # Pacenote.force_regen() for many pacenotes of this notebook at once. their files are
+    # deleted in one pass and dropped from the audio index together, so none of them look
+    # done in between.
+    def force_regen(self, pacenotes):
+        paths = [pacenote.note_abs_path() for pacenote in pacenotes]
+        self.force_regen_paths.update(paths)
+        self.audio_index.remove_many(paths)
+
+        deleted = 0
+        for path in paths:
+            try:
+                os.remove(path)
+                deleted += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.error(f"error: {path} : {e.strerror}")
+        logging.info(f"deleted {deleted} audio files to re-generate {len(paths)} pacenotes")
+
+    # for when the generated audio changed on disk behind our back.
+    def invalidate_voice_manifests(self):
+        with self.voice_manifests_lock:
+            for manifest in self.voice_manifests.values():
+                manifest.invalidate()
+
+    # drops what the file watcher's `paths` made stale from the audio index and the voice
+    # manifests. the app's own writes are already in both, so only what changed behind its
+    # back is read again. returns whether there was any of that.
+    def apply_external_changes(self, paths):
+        pacenotes_dir = self.pacenotes_dir()
+        changed = False
+
+        for path in paths:
+            if path == pacenotes_dir or pacenotes_dir.startswith(path + '/'):
+                # the whole tree may have been replaced.
+                self.audio_index.invalidate()
+                self.invalidate_voice_manifests()
+                return True
+            if not path.startswith(pacenotes_dir + '/'):
+                continue
+
+            dirname, _, basename = path.rpartition('/')
+            if is_temp_name(basename):
+                continue
+
+            if basename == MANIFEST_FNAME:
+                with self.voice_manifests_lock:
+                    manifest = self.voice_manifests.get(dirname)
+                if manifest is not None and not manifest.reflects_disk():
+                    manifest.invalidate()
+                    changed = True
+                continue
+
+            if not self.audio_index.reflects(path):
+                logging.debug(f"audio changed on disk: {path}")
+                self.audio_index.invalidate(dirname)
+                self.audio_index.invalidate(path)
+                # a codriver dir that was replaced brings its own manifest.
+                with self.voice_manifests_lock:
+                    manifest = self.voice_manifests.get(path)
+                if manifest is not None:
+                    manifest.invalidate()
+                changed = True
+
+        return changed
 
     def notebook(self):
-        return Notebook(self, self.data)
-
+        with self.load_lock:
+            if self.data is None:
+                return None
+            if self._notebook is None:
+                self._notebook = Notebook(self, self.data)
+            return self._notebook
+
+    # every job id includes it, so it's only worked out once.
     def mission_id(self):
+        if self._mission_id is not None:
+            return self._mission_id
+
         pattern = r"missions/([^/]+/[^/]+/[^/]+)"
         match = re.search(pattern, self.fname)
 
         if match:
-            return aipacenotes.util.normalize_path(match.group(1))
+            self._mission_id = aipacenotes.util.normalize_path(match.group(1))
+            return self._mission_id
         else:
             raise ValueError(f"couldnt extract mission id from: {self.fname}")
 
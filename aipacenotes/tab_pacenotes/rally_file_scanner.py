@@ -1,6 +1,10 @@
-import pathlib
+import os
+import json
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+import aipacenotes.util
 from .rally_file import NotebookFile
 
 class SearchPath:
@@ -16,24 +20,321 @@ class SearchPath:
     def file_explorer_path(self):
         return self.fname
 
+# persisted results of the last scan, so the tree can be shown before the filesystem is
+# walked. for each search path it records every directory's mtime with its subdirectories
+# and notebook files, so a directory whose mtime hasn't moved is never listed again.
+# notebook metadata is filled in as notebooks get parsed.
+class ScanIndex:
+    version = 1
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.lock = threading.Lock()
+        self.dirs = {}
+        self.notebooks = {}
+        self.loaded = False
+        # whether there are notebook metadata changes that haven't been saved yet.
+        self.dirty = False
+
+    def load(self):
+        self.loaded = True
+        try:
+            with open(self.fname, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            logging.warning(f"ignoring unreadable scan index {self.fname}: {e}")
+            return False
+
+        if data.get('version') != self.version:
+            return False
+
+        with self.lock:
+            self.dirs = data.get('dirs', {})
+            self.notebooks = data.get('notebooks', {})
+        return True
+
+    def save(self):
+        with self.lock:
+            self.dirty = False
+            data = {
+                'version': self.version,
+                'dirs': self.dirs,
+                'notebooks': self.notebooks,
+            }
+            tmp_fname = f"{self.fname}.tmp"
+            try:
+                with open(tmp_fname, 'w', encoding='utf-8') as f:
+                    json.dump(data, f)
+                os.replace(tmp_fname, self.fname)
+            except OSError as e:
+                logging.error(f"couldnt save scan index {self.fname}: {e}")
+
+    def search_path_dirs(self, search_path):
+        with self.lock:
+            return self.dirs.get(search_path, {})
+
+    def set_search_path_dirs(self, search_path, dirs):
+        with self.lock:
+            self.dirs[search_path] = dirs
+
+    def search_path_notebooks(self, search_path):
+        with self.lock:
+            dirs = self.dirs.get(search_path, {})
+            return sorted(fname for entry in dirs.values() for fname in entry['notebooks'])
+
+    def notebook_metadata(self, fname):
+        with self.lock:
+            return self.notebooks.get(fname)
+
+    def set_notebook_metadata(self, fname, metadata):
+        with self.lock:
+            self.notebooks[fname] = metadata
+
+    def has_changes(self):
+        with self.lock:
+            return self.dirty
+
+    def prune(self, keep_search_paths, keep_fnames):
+        with self.lock:
+            self.dirs = {k: v for k, v in self.dirs.items() if k in keep_search_paths}
+            self.notebooks = {k: v for k, v in self.notebooks.items() if k in keep_fnames}
+
+    # called when a notebook file gets parsed, which is on every save while it's being
+    # edited, so it only marks the index dirty. the owner saves it every so often.
+    def update_notebook_metadata(self, notebook_file):
+        metadata = notebook_file.metadata
+        with self.lock:
+            if self.notebooks.get(notebook_file.fname) != metadata:
+                self.notebooks[notebook_file.fname] = dict(metadata)
+                self.dirty = True
+
 class RallyFileScanner:
     pattern =  '*.notebook.json'
+    suffix = '.notebook.json'
+
+    # directories that never contain notebooks but can hold thousands of files.
+    skip_dirnames = {
+        'generated_pacenotes',
+        'backups',
+        '.git',
+        '__pycache__',
+    }
 
-    def __init__(self, settings_manager):
+    def __init__(self, settings_manager, max_workers=8):
         self.settings_manager = settings_manager
+        self.max_workers = max_workers
         self.search_paths = []
+        self.lock = threading.Lock()
+        self.index = None
+        self.notebook_files = {}
+        self.emitted = {}
+        self.stats = {}
+
+    def _ensure_index(self):
+        fname = self.settings_manager.get_scan_index_fname()
+        with self.lock:
+            if self.index is None or self.index.fname != fname:
+                self.index = ScanIndex(fname)
+                self.index.load()
+
+    def _notebook_file(self, fname):
+        with self.lock:
+            rally = self.notebook_files.get(fname)
+            if rally is None:
+                rally = NotebookFile(fname, self.settings_manager, scan_index=self.index)
+                self.notebook_files[fname] = rally
+
+        metadata = self.index.notebook_metadata(fname)
+        if metadata:
+            rally.metadata = dict(metadata)
+        return rally
+
+    def _scan_dir(self, dirname, subdirs, matches):
+        try:
+            with os.scandir(dirname) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in self.skip_dirnames:
+                            subdirs.append(aipacenotes.util.normalize_path(entry.path))
+                    elif entry.name.endswith(self.suffix) and entry.is_file():
+                        matches.append(aipacenotes.util.normalize_path(entry.path))
+        except OSError as e:
+            logging.debug(f"couldnt scan {dirname}: {e}")
+
+    def _validate_notebook(self, fname):
+        metadata = self.index.notebook_metadata(fname)
+        try:
+            st = os.stat(fname)
+        except OSError:
+            return
+
+        if metadata and metadata.get('mtime_ns') == st.st_mtime_ns and metadata.get('size') == st.st_size:
+            return
+
+        rally = NotebookFile(fname, self.settings_manager)
+        try:
+            mission_id = rally.mission_id()
+        except ValueError:
+            mission_id = None
 
-    def scan(self):
+        # the name and pacenote count are only known once the notebook is parsed, so the
+        # last ones seen are kept until then.
+        metadata = dict(metadata or {})
+        metadata.update({
+            'mtime_ns': st.st_mtime_ns,
+            'size': st.st_size,
+            'mission_id': mission_id,
+        })
+        self.index.set_notebook_metadata(fname, metadata)
+
+    # calls on_found for the notebooks in `fnames` that haven't been reported for this
+    # search path yet.
+    def _report_found(self, sp, fnames, on_found):
+        with self.lock:
+            emitted = self.emitted.setdefault(sp.fname, set())
+            new_fnames = [fname for fname in fnames if fname not in emitted]
+            emitted.update(new_fnames)
+
+        for fname in new_fnames:
+            rally = self._notebook_file(fname)
+            if on_found:
+                on_found(sp, rally)
+
+    # walks from `top`, re-listing only directories whose mtime moved since the index.
+    def _walk(self, top, sp, old_dirs, new_dirs, found, on_found):
+        stack = [top]
+        while stack:
+            dirname = stack.pop()
+            try:
+                mtime_ns = os.stat(dirname).st_mtime_ns
+            except OSError:
+                continue
+
+            entry = old_dirs.get(dirname)
+            if entry and entry['mtime_ns'] == mtime_ns:
+                stat_key = 'reused'
+            else:
+                subdirs = []
+                matches = []
+                self._scan_dir(dirname, subdirs, matches)
+                entry = {'mtime_ns': mtime_ns, 'subdirs': subdirs, 'notebooks': matches}
+                stat_key = 'listed'
+
+            for fname in entry['notebooks']:
+                self._validate_notebook(fname)
+
+            with self.lock:
+                new_dirs[dirname] = entry
+                found.extend(entry['notebooks'])
+                self.stats[stat_key] = self.stats.get(stat_key, 0) + 1
+
+            self._report_found(sp, entry['notebooks'], on_found)
+            stack.extend(entry['subdirs'])
+
+    # reports the notebooks recorded by the last scan without touching the search paths.
+    def scan_cached(self, on_found=None):
+        self._ensure_index()
         self.search_paths = []
+        self.emitted = {}
 
         for search_path in self.settings_manager.get_pacenotes_search_paths():
             sp = SearchPath(search_path)
-            logging.info(f'scanning {search_path} for {self.pattern}')
-            matches = pathlib.Path(search_path).rglob(self.pattern)
+            self.search_paths.append(sp)
+            self.emitted[search_path] = set()
 
-            for match in matches:
-                rally = NotebookFile(match, self.settings_manager)
-                rally.load()
+            for fname in self.index.search_path_notebooks(search_path):
+                rally = self._notebook_file(fname)
                 sp.rally_files.append(rally)
+                self.emitted[search_path].add(fname)
+                if on_found:
+                    on_found(sp, rally)
+
+    # walks every search path with a pool of threads, one task per top level directory,
+    # checking the results against the index. on_found(search_path, notebook_file) is called
+    # from the worker threads as notebooks that weren't already reported by scan_cached()
+    # (or an earlier scan) are found. on_removed is called the same way once the walk is
+    # done, for the ones that have gone away. notebook files are not loaded; that happens
+    # when one is selected.
+    def scan(self, on_found=None, on_removed=None):
+        self._ensure_index()
+        self.stats = {}
+        search_paths = []
+        sps = {}
+        found_by_path = {}
+        new_dirs_by_path = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = []
+            for search_path in self.settings_manager.get_pacenotes_search_paths():
+                logging.info(f'scanning {search_path} for {self.pattern}')
+                search_paths.append(search_path)
+                sp = SearchPath(search_path)
+                sps[search_path] = sp
+                old_dirs = self.index.search_path_dirs(search_path)
+                new_dirs = {}
+                found = []
+                new_dirs_by_path[search_path] = new_dirs
+                found_by_path[search_path] = found
+
+                try:
+                    mtime_ns = os.stat(search_path).st_mtime_ns
+                except OSError:
+                    continue
 
+                # the search path itself is handled inline to fan its children out.
+                entry = old_dirs.get(search_path)
+                if not entry or entry['mtime_ns'] != mtime_ns:
+                    subdirs = []
+                    matches = []
+                    self._scan_dir(search_path, subdirs, matches)
+                    entry = {'mtime_ns': mtime_ns, 'subdirs': subdirs, 'notebooks': matches}
+                new_dirs[search_path] = entry
+                found.extend(entry['notebooks'])
+                for fname in entry['notebooks']:
+                    self._validate_notebook(fname)
+                self._report_found(sp, entry['notebooks'], on_found)
+
+                for subdir in entry['subdirs']:
+                    futures.append(executor.submit(self._walk, subdir, sp, old_dirs, new_dirs, found, on_found))
+
+            for future in futures:
+                future.result()
+
+        all_found = set()
+        self.search_paths = []
+        for search_path in search_paths:
+            self.index.set_search_path_dirs(search_path, new_dirs_by_path[search_path])
+            found = set(found_by_path[search_path])
+            all_found |= found
+
+            sp = sps[search_path]
+            sp.rally_files = [self._notebook_file(fname) for fname in sorted(found)]
             self.search_paths.append(sp)
+
+            # everything found was already reported by the walk.
+            emitted = self.emitted.get(search_path, set())
+            for fname in sorted(emitted - found):
+                if on_removed:
+                    on_removed(sp, self._notebook_file(fname))
+            self.emitted[search_path] = found
+
+            logging.info(f'found {len(found)} notebooks in {search_path}')
+
+        logging.info(f"scan dirs: listed={self.stats.get('listed', 0)} reused={self.stats.get('reused', 0)}")
+        self.index.prune(search_paths, all_found)
+        self.index.save()
+
+    # the NotebookFile for `fname` that the scan reports, or will, so whatever is loaded
+    # through it is shared with the tree. safe to call before or during a scan.
+    def notebook_file(self, fname):
+        self._ensure_index()
+        return self._notebook_file(aipacenotes.util.normalize_path(fname))
+
+    def index_has_changes(self):
+        return self.index is not None and self.index.has_changes()
+
+    def save_index(self):
+        if self.index_has_changes():
+            self.index.save()
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import time
+import shutil
+import logging
+import threading
+from collections import OrderedDict
+
+import aipacenotes.util
+
+# orphaned audio is moved here instead of being deleted, so an edit that's undone gets
+# its audio back without another trip to the server. files are kept as
+# `<codriver dir>.<notebook digest>/<basename>`, which is what identifies the audio, and are
+# evicted least recently used first once the total size or their age goes over the limits.
+# the digest is of the notebook's pacenotes dir, since codrivers in different notebooks can
+# share a name.
+class RecycleBin:
+    def __init__(self, root_dir, max_bytes, max_age_sec):
+        self.root_dir = aipacenotes.util.normalize_path(root_dir)
+        self.max_bytes = max_bytes
+        self.max_age_sec = max_age_sec
+        self.lock = threading.Lock()
+        # key -> [size, last used], oldest first.
+        self.entries = None
+        self.total_bytes = 0
+        self.restored_count = 0
+
+    def _key(self, path):
+        path = aipacenotes.util.normalize_path(path)
+        dirname, _, basename = path.rpartition('/')
+        notebook_dir, _, codriver_dir = dirname.rpartition('/')
+        digest = hashlib.sha1(notebook_dir.encode('utf-8')).hexdigest()[:12]
+        return f"{codriver_dir}.{digest}/{basename}"
+
+    def _path(self, key):
+        return f'{self.root_dir}/{key}'
+
+    def _load(self):
+        found = []
+        try:
+            with os.scandir(self.root_dir) as it:
+                for d in it:
+                    if not d.is_dir():
+                        continue
+                    with os.scandir(d.path) as files:
+                        for f in files:
+                            st = f.stat()
+                            found.append((st.st_mtime, f'{d.name}/{f.name}', st.st_size))
+        except FileNotFoundError:
+            pass
+
+        found.sort()
+        self.entries = OrderedDict((key, [size, mtime]) for mtime, key, size in found)
+        self.total_bytes = sum(size for size, _ in self.entries.values())
+
+    def _ensure_loaded(self):
+        if self.entries is None:
+            self._load()
+
+    def _evict(self, now):
+        while self.entries:
+            key, (size, used_at) = next(iter(self.entries.items()))
+            if self.total_bytes <= self.max_bytes and now - used_at <= self.max_age_sec:
+                break
+            self.entries.pop(key)
+            self.total_bytes -= size
+            try:
+                os.remove(self._path(key))
+            except OSError as e:
+                logging.debug(f"couldnt evict {key} from recycle bin: {e}")
+
+    # moves `path` into the bin. audio that still has another hardlink, ie it's in the
+    # audio store, is just deleted.
+    def recycle(self, path):
+        st = os.stat(path)
+        if st.st_nlink > 1:
+            os.remove(path)
+            return
+
+        key = self._key(path)
+        dest = self._path(key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        try:
+            os.replace(path, dest)
+        except OSError:
+            # the bin lives on another drive.
+            shutil.move(path, dest)
+
+        now = time.time()
+        os.utime(dest, (now, now))
+
+        with self.lock:
+            self._ensure_loaded()
+            old = self.entries.pop(key, None)
+            if old:
+                self.total_bytes -= old[0]
+            self.entries[key] = [st.st_size, now]
+            self.total_bytes += st.st_size
+            self._evict(now)
+
+    # moves audio for `dest` back out of the bin. returns False if there isn't any.
+    def restore(self, dest):
+        key = self._key(dest)
+        with self.lock:
+            self._ensure_loaded()
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return False
+            self.total_bytes -= entry[0]
+
+        src = self._path(key)
+        try:
+            try:
+                os.replace(src, dest)
+            except OSError:
+                shutil.move(src, dest)
+        except OSError as e:
+            logging.debug(f"couldnt restore {key} from recycle bin: {e}")
+            return False
+
+        with self.lock:
+            self.restored_count += 1
+        return True
+
+    def evict(self):
+        with self.lock:
+            self._ensure_loaded()
+            self._evict(time.time())
@@ -0,0 +1,26 @@
+import random
+
+# statuses that mean the server couldn't handle the request right now, rather than that
+# the request itself was bad.
+RETRYABLE_STATUS_CODES = {408, 425, 429}
+
+# decides whether a failed job gets another try and how long it waits for it. the wait
+# doubles with each failure, and half of it is random so jobs failed by the same outage
+# don't all come back at the same moment.
+class RetryPolicy:
+    def __init__(self, max_attempts=5, base_delay_sec=1.0, max_delay_sec=60.0, give_up_sec=300.0):
+        self.max_attempts = max_attempts
+        self.base_delay_sec = base_delay_sec
+        self.max_delay_sec = max_delay_sec
+        # how long a pacenote that failed for good is left alone before it's tried again.
+        self.give_up_sec = give_up_sec
+
+    def is_retryable_status(self, status_code):
+        return status_code in RETRYABLE_STATUS_CODES or status_code >= 500
+
+    def should_retry(self, attempts, retryable):
+        return retryable and attempts < self.max_attempts
+
+    def delay(self, attempts):
+        cap = min(self.max_delay_sec, self.base_delay_sec * (2 ** (attempts - 1)))
+        return cap / 2 + random.uniform(0, cap / 2)
@@ -0,0 +1,61 @@
+import difflib
+
+from PyQt6.QtCore import QModelIndex
+
+def _changed_runs(indexes):
+    runs = []
+    for idx in indexes:
+        if runs and runs[-1][1] == idx - 1:
+            runs[-1][1] = idx
+        else:
+            runs.append([idx, idx])
+    return runs
+
+# brings a table model's `rows`/`fingerprints` lists in line with `new_rows`, emitting the
+# precise insert/remove/dataChanged signals instead of a layoutChanged. rows are matched
+# by key_fn, and a matched row is repainted only when its fingerprint changed.
+# must be called on the gui thread.
+def sync_rows(model, rows, fingerprints, new_rows, new_fingerprints, key_fn):
+    last_col = model.columnCount() - 1
+
+    def emit_changed(offset, old_fps, new_fps):
+        changed = [i for i, (a, b) in enumerate(zip(old_fps, new_fps)) if a != b]
+        for first, last in _changed_runs(changed):
+            model.dataChanged.emit(model.index(offset + first, 0), model.index(offset + last, last_col))
+        return len(changed)
+
+    old_keys = [key_fn(row) for row in rows]
+    new_keys = [key_fn(row) for row in new_rows]
+
+    if old_keys == new_keys:
+        changed_count = emit_changed(0, fingerprints, new_fingerprints)
+        rows[:] = new_rows
+        fingerprints[:] = new_fingerprints
+        return changed_count
+
+    changed_count = 0
+    matcher = difflib.SequenceMatcher(None, old_keys, new_keys, autojunk=False)
+
+    # walk backwards so the old indexes of earlier opcodes stay valid.
+    for tag, i1, i2, j1, j2 in reversed(matcher.get_opcodes()):
+        if tag == 'equal':
+            changed_count += emit_changed(i1, fingerprints[i1:i2], new_fingerprints[j1:j2])
+            rows[i1:i2] = new_rows[j1:j2]
+            fingerprints[i1:i2] = new_fingerprints[j1:j2]
+            continue
+
+        if i2 > i1:
+            model.beginRemoveRows(QModelIndex(), i1, i2 - 1)
+            del rows[i1:i2]
+            del fingerprints[i1:i2]
+            model.endRemoveRows()
+
+        if j2 > j1:
+            model.beginInsertRows(QModelIndex(), i1, i1 + (j2 - j1) - 1)
+            rows[i1:i1] = new_rows[j1:j2]
+            fingerprints[i1:i1] = new_fingerprints[j1:j2]
+            model.endInsertRows()
+
+        changed_count += (i2 - i1) + (j2 - j1)
+
+    return changed_count
@@ -1,20 +1,55 @@
+import asyncio
+import collections
+import heapq
+import itertools
 import logging
+import threading
 import time
 
+import aiohttp
+
+import aipacenotes.util
+
 from aipacenotes import client as aip_client
+from .audio_download import AudioDownload, DOWNLOAD_CHUNK_SIZE
+from .audio_store import AudioStore
+from .recycle_bin import RecycleBin
+from .retry_policy import RetryPolicy
 
+# jobs are keyed by the audio file they write. it's named by the note's hash, in a dir per
+# notebook and codriver voice, so pacenotes with the same text share one job.
 def pacenote_job_id(pacenote):
-    mission_id = pacenote.notebook.notebook_file.mission_id()
-    return f'{mission_id}_{pacenote.notebook.name()}_{pacenote.codriver_name()}_{pacenote.name()}'
+    return pacenote.note_abs_path()
+
+# a pacenote whatever its note says, to find the job for its previous note when it changes.
+def pacenote_slot(pacenote):
+    return (pacenote.notebook.notebook_file.fname, pacenote.codriver_name(), pacenote.name())
 
 UPDATE_JOB_STATUS_UPDATING = 'updating'
+UPDATE_JOB_STATUS_RETRYING = 'retrying'
 UPDATE_JOB_STATUS_SUCCESS = 'success'
 UPDATE_JOB_STATUS_ERROR = 'error'
 
+# status changes go through the store, which keeps jobs indexed by status.
 class UpdateJob:
-    def __init__(self, store, pacenote):
+    def __init__(self, store, pacenote, id=None):
         self.store = store
         self.pacenote = pacenote
+        self.id = id or pacenote_job_id(pacenote)
+        self.priority = store.job_priority(pacenote)
+        # a pacenote whose note changes stops being held back by this job's failure.
+        self.note_text = pacenote.note()
+        self.attempts = 0
+        self.retry_at = None
+        # when a new job may be sent, if it's still waiting for its note to stop changing.
+        self.settle_at = None
+        # set by the store once no pacenote wants this job's audio anymore.
+        self.cancelled = False
+        # the voice config fingerprint the job's request was built with, set by store_key().
+        # its audio is recorded as made with this one, even if the voice changed meanwhile.
+        self.voice_fingerprint = None
+        # the other pacenotes that use the same audio file, by name.
+        self.waiters = {}
         self._status = UPDATE_JOB_STATUS_UPDATING
         self._created_at = time.time()
         self._updated_at = self._created_at
@@ -36,170 +71,763 @@ class UpdateJob:
     def status(self):
         return self._status
 
-    def run(self, done_signal):
-        logging.debug(f"UpdateJob.run '{self.pacenote}'")
+    def voice_config(self):
+        return self.store.settings_manager.voice_config(self.pacenote.voice())
+
+    def store_key(self, audio_store, voice_fingerprint):
+        self.voice_fingerprint = voice_fingerprint
+        return audio_store.key(self.pacenote.note(), voice_fingerprint)
+
+    # the voice changed while the request was out, so the audio it got is already stale.
+    def voice_changed(self):
+        return self.voice_fingerprint is not None and self.voice_fingerprint != self.pacenote.voice_fingerprint()
+
+    def place_from_store(self, audio_store, store_key):
+        if self.pacenote.place_from_store(audio_store, store_key, self.voice_fingerprint):
+            logging.debug(f"reused stored audio for '{self.pacenote}'")
+            return True
+        return False
+
+    def restore_from_recycle_bin(self):
+        if self.pacenote.restore_from_recycle_bin(self.store.recycle_bin(), self.voice_fingerprint):
+            logging.debug(f"restored recycled audio for '{self.pacenote}'")
+            return True
+        return False
+
+    # audio that was already generated once is reused unless a re-generate was forced.
+    def resolve_locally(self, audio_store, store_key):
+        if self.pacenote.is_force_regen():
+            return False
+        if self.place_from_store(audio_store, store_key):
+            self.store.touch(self, UPDATE_JOB_STATUS_SUCCESS)
+            return True
+        # recycled audio has no record of its voice, so it's only a stand-in for a missing
+        # file, never for one that's stale.
+        if not self.pacenote.note_file_exists() and self.restore_from_recycle_bin():
+            self.store.touch(self, UPDATE_JOB_STATUS_SUCCESS)
+            return True
+        return False
+
+    # called with the store's lock held.
+    def attach(self, pacenote):
+        if pacenote.name() == self.pacenote.name():
+            return
+        self.waiters[pacenote.name()] = pacenote
+        self.priority = min(self.priority, self.store.job_priority(pacenote))
+
+    # called with the store's lock held, for a pacenote that wants other audio now. returns
+    # whether any pacenote still wants this job's.
+    def detach(self, pacenote):
+        if pacenote.name() != self.pacenote.name():
+            self.waiters.pop(pacenote.name(), None)
+        elif self.waiters:
+            self.pacenote = self.waiters.pop(next(iter(self.waiters)))
+        else:
+            return False
+        return True
+
+    def pacenotes(self):
+        return [self.pacenote] + list(self.waiters.values())
+
+    def pacenote_names(self):
+        with self.store.lock:
+            return [self.pacenote.name()] + list(self.waiters)
+
+    # a forced re-generate is over once its job is, however the job ended, so a pacenote
+    # isn't left jumping the queue and skipping the audio store for good.
+    def clear_force_regen(self):
+        with self.store.lock:
+            for pacenote in self.pacenotes():
+                pacenote.clear_force_regen()
+
+    def is_done(self):
+        return self._status in (UPDATE_JOB_STATUS_SUCCESS, UPDATE_JOB_STATUS_ERROR)
+
+    # `retryable` failures go back in the store's retry queue until the retry policy gives up.
+    def set_error(self, retryable=False):
+        if self.cancelled:
+            return
+        self.attempts += 1
+        if self.store.retry_policy.should_retry(self.attempts, retryable):
+            self.store.schedule_retry(self)
+        else:
+            self.store.set_error(self)
 
+    def open_download(self):
+        self.pacenote.ensure_pacenotes_dir()
+        return AudioDownload(self.pacenote.note_abs_path())
+
+    # puts the downloaded audio in place and adds it to the audio store. audio that can't
+    # be saved or doesn't look right counts as a failed attempt.
+    def finish_download(self, download, audio_store, store_key):
+        if self.cancelled:
+            download.abort()
+            logging.debug(f"dropped the audio of a cancelled job for '{self.pacenote}'")
+            return
+        try:
+            download.commit()
+        except (OSError, ValueError) as e:
+            logging.error(f"couldnt save audio for '{self.pacenote}': {e}")
+            self.set_error(retryable=True)
+            return
+        self.pacenote.audio_index().add(self.pacenote.note_abs_path())
+        self.pacenote.record_voice(self.voice_fingerprint)
+        audio_store.adopt(store_key, self.pacenote.note_abs_path())
+        self.clear_force_regen()
+        self.store.touch(self, UPDATE_JOB_STATUS_SUCCESS)
+
+    # for audio that arrives whole, in a batch frame.
+    def handle_audio(self, data, audio_store, store_key):
+        try:
+            download = self.open_download()
+        except OSError as e:
+            logging.error(f"couldnt save audio for '{self.pacenote}': {e}")
+            self.set_error(retryable=True)
+            return
+
+        try:
+            download.write(data)
+        except OSError as e:
+            download.abort()
+            logging.error(f"couldnt save audio for '{self.pacenote}': {e}")
+            self.set_error(retryable=True)
+            return
+
+        self.finish_download(download, audio_store, store_key)
+
+    def handle_error_status(self, status_code, text):
+        logging.error(f"network error: {status_code} {text}")
+        self.set_error(self.store.retry_policy.is_retryable_status(status_code))
+
+    async def save_audio_async(self, content, audio_store, store_key):
+        try:
+            download = await asyncio.to_thread(self.open_download)
+        except OSError as e:
+            logging.error(f"couldnt save audio for '{self.pacenote}': {e}")
+            self.set_error(retryable=True)
+            return
+
+        try:
+            async for chunk in content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                if self.cancelled:
+                    break
+                await asyncio.to_thread(download.write, chunk)
+        except (OSError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            download.abort()
+            logging.error(f"couldnt download audio for '{self.pacenote}': {e}")
+            self.set_error(retryable=True)
+            return
+        except BaseException:
+            download.abort()
+            raise
+
+        await asyncio.to_thread(self.finish_download, download, audio_store, store_key)
+
+    async def request_audio_async(self, engine, voice_config, audio_store, store_key):
+        session = await engine.http_session()
+        async with engine.limit(self.priority):
+            # cancelled while waiting for a slot, so it's never sent.
+            if self.cancelled:
+                return
+            start = time.perf_counter()
+            try:
+                response = await aip_client.post_create_pacenote_audio_async(
+                    session,
+                    self.pacenote.name(),
+                    self.pacenote.note(),
+                    voice_config,
+                )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                engine.record(time.perf_counter() - start, failed=True)
+                logging.error(f"network error: {e}")
+                self.set_error(retryable=True)
+                return
+
+            # time to the response headers, which is what the server's queueing shows up in.
+            engine.record(time.perf_counter() - start, engine.is_overload_status(response.status))
+            try:
+                if response.status == 200:
+                    await self.save_audio_async(response.content, audio_store, store_key)
+                else:
+                    self.handle_error_status(response.status, await response.text())
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.error(f"network error: {e}")
+                self.set_error(retryable=True)
+            finally:
+                response.release()
+
+    async def wait_for_pending_async(self, pending, engine, voice_config, audio_store, store_key):
+        deadline = time.time() + 120
+        while not pending.is_set() and time.time() < deadline:
+            await asyncio.sleep(0.05)
+        if self.cancelled or await asyncio.to_thread(self.resolve_locally, audio_store, store_key):
+            return
+        await self.request_audio_async(engine, voice_config, audio_store, store_key)
+
+    def finish(self, done_signal):
+        self.store.finish(self)
         self.update_ago_cache()
+        done_signal.emit(self)
 
-        voice = self.pacenote.voice()
-        voice_config = self.store.settings_manager.voice_config(voice)
+    # runs on the AsyncEngine. file work is done on worker threads to keep the loop free.
+    async def run_async(self, engine, done_signal):
+        logging.debug(f"UpdateJob.run_async '{self.pacenote}'")
 
-        if voice_config:
-            response = aip_client.post_create_pacenote_audio(
-                self.pacenote.name(),
-                self.pacenote.note(),
-                voice_config,
-            )
+        self.update_ago_cache()
 
-            if response.status_code == 200:
-                self.pacenote.write_file(response.content)
-                self._status = UPDATE_JOB_STATUS_SUCCESS
-            else:
-                logging.error(f"network error: {response.status_code} {response.text}")
-                self._status = UPDATE_JOB_STATUS_ERROR
-                self.store.set_error(self)
+        voice_config = self.voice_config()
+        voice_fingerprint = self.pacenote.voice_fingerprint()
+
+        if self.cancelled:
+            logging.debug(f"skipped a cancelled job for '{self.pacenote}'")
+        elif voice_config:
+            audio_store = self.store.audio_store()
+            store_key = self.store_key(audio_store, voice_fingerprint)
+
+            if not await asyncio.to_thread(self.resolve_locally, audio_store, store_key):
+                pending = audio_store.acquire(store_key)
+                if pending:
+                    await self.wait_for_pending_async(pending, engine, voice_config, audio_store, store_key)
+                else:
+                    try:
+                        await self.request_audio_async(engine, voice_config, audio_store, store_key)
+                    finally:
+                        audio_store.release(store_key)
         else:
             logging.error(f"no voice_config")
-            self._status = UPDATE_JOB_STATUS_ERROR
-            self.store.set_error(self)
+            self.set_error()
 
-        self._updated_at = time.time()
-        self.update_ago_cache()
+        self.finish(done_signal)
 
-        self.store.sort()
-        self.store.prune()
-        self.store.clear_lock(self)
-        done_signal.emit(self)
+# jobs for pacenotes in the same voice, generated with a single request. jobs whose audio
+# is already around are finished without being sent, and a server without the batch
+# endpoint gets one request per job instead.
+class UpdateJobBatch:
+    def __init__(self, store, jobs, voice_config, voice_fingerprint):
+        self.store = store
+        self.jobs = jobs
+        self.voice_config = voice_config
+        self.voice_fingerprint = voice_fingerprint
+        self.priority = min(job.priority for job in jobs)
+
+    def __len__(self):
+        return len(self.jobs)
+
+    async def run_async(self, engine, done_signal):
+        if len(self.jobs) == 1 or not self.voice_config:
+            await asyncio.gather(*[job.run_async(engine, done_signal) for job in self.jobs])
+            return
+
+        logging.debug(f"UpdateJobBatch.run_async {len(self.jobs)} jobs")
+
+        audio_store = self.store.audio_store()
+        to_fetch = []
+        waiting = []
+
+        for job in self.jobs:
+            job.update_ago_cache()
+            store_key = job.store_key(audio_store, self.voice_fingerprint)
+            if job.cancelled or await asyncio.to_thread(job.resolve_locally, audio_store, store_key):
+                job.finish(done_signal)
+                continue
+
+            pending = audio_store.acquire(store_key)
+            if pending:
+                waiting.append((job, store_key, pending))
+            else:
+                to_fetch.append((job, store_key))
+
+        async def _request_one(job, store_key):
+            await job.request_audio_async(engine, self.voice_config, audio_store, store_key)
+            job.finish(done_signal)
+
+        try:
+            if len(to_fetch) == 1:
+                await _request_one(*to_fetch[0])
+            elif to_fetch:
+                await self.fetch_async(engine, to_fetch, audio_store, done_signal, _request_one)
+        finally:
+            for _, store_key in to_fetch:
+                audio_store.release(store_key)
+
+        async def _wait_one(job, store_key, pending):
+            await job.wait_for_pending_async(pending, engine, self.voice_config, audio_store, store_key)
+            job.finish(done_signal)
+
+        await asyncio.gather(*[_wait_one(*w) for w in waiting])
+
+    async def fetch_async(self, engine, to_fetch, audio_store, done_signal, request_one):
+        unfinished = dict(enumerate(to_fetch))
+        retryable = True
+        session = await engine.http_session()
+
+        try:
+            async with engine.limit(self.priority):
+                # jobs cancelled while waiting for a slot aren't sent.
+                for job, _ in to_fetch:
+                    if job.cancelled:
+                        job.finish(done_signal)
+                to_fetch = [(job, store_key) for job, store_key in to_fetch if not job.cancelled]
+                unfinished = dict(enumerate(to_fetch))
+                if not to_fetch:
+                    return
+                notes = [(job.pacenote.name(), job.pacenote.note()) for job, _ in to_fetch]
+
+                start = time.perf_counter()
+                try:
+                    response = await aip_client.post_create_pacenotes_audio_batch_async(session, notes, self.voice_config)
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    engine.record(time.perf_counter() - start, failed=True)
+                    raise
+
+                if response is not None:
+                    try:
+                        if response.status != 200:
+                            engine.record(time.perf_counter() - start, engine.is_overload_status(response.status))
+                            logging.error(f"network error: {response.status} {await response.text()}")
+                            retryable = self.store.retry_policy.is_retryable_status(response.status)
+                            return
+
+                        # jobs are finished as their audio arrives.
+                        async for index, ok, payload in aip_client.iter_batch_frames_async(response.content):
+                            if index not in unfinished:
+                                continue
+                            job, store_key = unfinished.pop(index)
+                            if ok:
+                                await asyncio.to_thread(job.handle_audio, payload, audio_store, store_key)
+                            else:
+                                logging.error(f"batch error for '{job.pacenote}': {payload.decode('utf-8', errors='replace')}")
+                                job.set_error(retryable=True)
+                            job.finish(done_signal)
+
+                        # per note, to be comparable with single requests.
+                        engine.record((time.perf_counter() - start) / len(notes))
+                    finally:
+                        response.release()
+                    return
+
+            # no batch endpoint, so each job goes on its own, outside the batch's slot.
+            singles = list(unfinished.values())
+            unfinished = {}
+            await asyncio.gather(*[request_one(job, store_key) for job, store_key in singles])
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.error(f"network error: {e}")
+        finally:
+            # whatever the server didn't answer for.
+            for job, _ in unfinished.values():
+                job.set_error(retryable)
+                job.finish(done_signal)
 
 class UpdateJobsStore:
-    def __init__(self, settings_manager):
+    # the order jobs are listed in.
+    status_order = [
+        UPDATE_JOB_STATUS_ERROR,
+        UPDATE_JOB_STATUS_RETRYING,
+        UPDATE_JOB_STATUS_UPDATING,
+        UPDATE_JOB_STATUS_SUCCESS,
+    ]
+
+    def __init__(self, settings_manager, journal=None):
         self.settings_manager = settings_manager
-        self.jobs = []
+        self.journal = journal
+        # jobs are added by the refresh thread, finished on the engine's loop and worker
+        # threads, and listed on the gui thread. everything below is guarded by this.
+        self.lock = threading.RLock()
+        # jobs by status, each least recently updated first, so a job moves between them
+        # in O(1) and pruning only looks at the jobs it prunes.
+        self.buckets = {status: collections.OrderedDict() for status in self.status_order}
+        # added but not yet handed out by take_batches().
+        self.pending_jobs = []
+        self.preferred_codriver = None
+        self._audio_store = None
+        self._recycle_bin = None
+        self.retry_policy = RetryPolicy()
+        # failed jobs waiting to be tried again, as a heap of (retry_at, seq, job).
+        self.retry_jobs = []
+        self.retry_seq = itertools.count()
         self.pacenote_ids_lock = {}
-        self.pacenote_ids_error = {}
+        # least recently failed first.
+        self.pacenote_ids_error = collections.OrderedDict()
+        # the latest job for each pacenote_slot(), so the job for a note that's since been
+        # edited can be cancelled.
+        self.slot_jobs = {}
+        # a notebook is saved over and over while it's being edited in game, so new jobs
+        # wait until their pacenote's note has stayed the same this long, oldest first.
+        self.settle_sec = 1.5
+        self.settling_jobs = collections.OrderedDict()
 
     def __len__(self):
-        return len(self.jobs)
+        with self.lock:
+            return sum(len(bucket) for bucket in self.buckets.values())
+
+    # follows the temp dir setting across settings reloads.
+    def audio_store(self):
+        root_dir = self.settings_manager.get_audio_store_dir()
+        limits = self.settings_manager.get_audio_store_limits()
+        max_bytes = limits['max_total_mb'] * 1024 * 1024
+        max_age_sec = limits['max_age_days'] * 24 * 60 * 60
+        if self._audio_store is None or self._audio_store.root_dir != aipacenotes.util.normalize_path(root_dir):
+            self._audio_store = AudioStore(root_dir, max_bytes, max_age_sec)
+        self._audio_store.max_bytes = max_bytes
+        self._audio_store.max_age_sec = max_age_sec
+        return self._audio_store
+
+    def recycle_bin(self):
+        root_dir = self.settings_manager.get_recycle_bin_dir()
+        limits = self.settings_manager.get_recycle_bin_limits()
+        max_bytes = limits['max_total_mb'] * 1024 * 1024
+        max_age_sec = limits['max_age_days'] * 24 * 60 * 60
+        if self._recycle_bin is None or self._recycle_bin.root_dir != aipacenotes.util.normalize_path(root_dir):
+            self._recycle_bin = RecycleBin(root_dir, max_bytes, max_age_sec)
+        self._recycle_bin.max_bytes = max_bytes
+        self._recycle_bin.max_age_sec = max_age_sec
+        return self._recycle_bin
+
+    # the jobs in display order: errors first, and the most recently updated first within
+    # a status.
+    def snapshot(self):
+        with self.lock:
+            jobs = []
+            for status in self.status_order:
+                jobs.extend(reversed(self.buckets[status]))
+            return jobs
 
     def update_job_time_agos(self):
-        for job in self.jobs:
+        for job in self.snapshot():
             job.update_ago_cache()
 
-    def sort(self):
-        status_order = {
-            UPDATE_JOB_STATUS_ERROR: 0,
-            UPDATE_JOB_STATUS_UPDATING: 1,
-            UPDATE_JOB_STATUS_SUCCESS: 2,
-        }
+    # marks the job as just updated, optionally with a new status.
+    def touch(self, job, status=None):
+        with self.lock:
+            if job.cancelled:
+                return
+            self.buckets[job._status].pop(job, None)
+            if status is not None:
+                job._status = status
+            job._updated_at = time.time()
+            self.buckets[job._status][job] = None
+            self.journal_job(job)
+
+    # finished jobs have nothing left to resume, so they're dropped from the journal.
+    def journal_job(self, job):
+        if self.journal is None:
+            return
+        if job.status() == UPDATE_JOB_STATUS_SUCCESS:
+            self.journal.remove(job.id)
+        else:
+            self.journal.record(job)
 
-        self.jobs.sort(
-            key=lambda job: (status_order[job.status()], -job.updated_at())
-        )
+    def finish(self, job):
+        with self.lock:
+            self.touch(job)
+            # a job waiting to be retried keeps its pacenote locked.
+            if job.is_done():
+                self.clear_lock(job)
 
+    # drops finished jobs from the list after a while, and lets pacenotes that failed for
+    # good be tried again once the retry policy's give up time has passed. returns how
+    # many of either there were.
     def prune(self):
-        prune_threshold_sec = time.time() - 30
-
-        def should_prune(job):
-            is_success = job.status() == UPDATE_JOB_STATUS_SUCCESS
-            is_error = job.status() == UPDATE_JOB_STATUS_ERROR
-            is_old = job.updated_at() < prune_threshold_sec
-            return ((is_error or is_success) and is_old)
+        now = time.time()
+        prune_threshold_sec = now - 30
+        give_up_threshold_sec = now - self.retry_policy.give_up_sec
+        pruned_count = 0
+
+        with self.lock:
+            for status in (UPDATE_JOB_STATUS_SUCCESS, UPDATE_JOB_STATUS_ERROR):
+                bucket = self.buckets[status]
+                while bucket:
+                    job = next(iter(bucket))
+                    if job.updated_at() >= prune_threshold_sec:
+                        break
+                    bucket.popitem(last=False)
+                    self.clear_lock(job)
+                    self._forget_slots(job)
+                    pruned_count += 1
+
+            while self.pacenote_ids_error:
+                job = next(iter(self.pacenote_ids_error.values()))
+                if job.updated_at() >= give_up_threshold_sec:
+                    break
+                self.pacenote_ids_error.popitem(last=False)
+                if self.journal:
+                    self.journal.remove(job.id)
+                pruned_count += 1
+
+        return pruned_count
+
+    # jobs are sent once they've settled, unless `settle` is off or it's a forced re-generate.
+    def add_job(self, pacenote, settle=True):
+        id = pacenote_job_id(pacenote)
+        slot = pacenote_slot(pacenote)
 
-        new_jobs = []
+        with self.lock:
+            self._supersede(slot, id, pacenote)
 
-        for job in self.jobs:
-            if should_prune(job):
-                self.clear_lock(job)
-                self.clear_error(job)
-            else:
-                new_jobs.append(job)
-
-        self.jobs = new_jobs
+            # a pacenote whose audio is already on its way waits for that job instead.
+            job = self.pacenote_ids_lock.get(id)
+            if job is not None:
+                job.attach(pacenote)
+                self.slot_jobs[slot] = job
+                return None
 
-    def get(self, idx):
-        return self.jobs[idx]
+            if self._has_job(id, pacenote):
+                return None
 
-    def add_job(self, pacenote):
-        id = pacenote_job_id(pacenote)
+            job = UpdateJob(self, pacenote, id)
 
-        if self.has_job_for_pacenote(pacenote):
-            return None
+            self.buckets[job._status][job] = None
+            if settle and not pacenote.is_force_regen():
+                job.settle_at = job.created_at() + self.settle_sec
+                self.settling_jobs[job] = None
+            else:
+                self.pending_jobs.append(job)
+            self.pacenote_ids_lock[id] = job
+            self.slot_jobs[slot] = job
+            self.journal_job(job)
 
-        job = UpdateJob(self, pacenote)
+        return job
 
-        self.jobs.append(job)
-        self.pacenote_ids_lock[id] = job
-        self.sort()
+    # the pacenote's note changed since its last job was added, so it doesn't want that
+    # job's audio anymore. the job is cancelled unless another pacenote still wants it.
+    def _supersede(self, slot, id, pacenote):
+        job = self.slot_jobs.get(slot)
+        if job is None or job.id == id or job.cancelled or job.is_done():
+            return
+        del self.slot_jobs[slot]
+        if not job.detach(pacenote):
+            self.cancel(job)
+
+    # the supersede check for every pacenote of a notebook, not just the ones that get a
+    # new job. a note changed to one whose audio already exists needs no job, but its old
+    # one still has to go. jobs for pacenotes that were deleted from the notebook, or whose
+    # codriver was, are dropped the same way. `pacenotes` is all of the notebook's.
+    def supersede_slots(self, fname, pacenotes):
+        with self.lock:
+            slots = set()
+            for pacenote in pacenotes:
+                slot = pacenote_slot(pacenote)
+                slots.add(slot)
+                self._supersede(slot, pacenote_job_id(pacenote), pacenote)
+
+            for slot, job in list(self.slot_jobs.items()):
+                if slot[0] != fname or slot in slots:
+                    continue
+                del self.slot_jobs[slot]
+                if job.cancelled or job.is_done():
+                    continue
+                for pacenote in job.pacenotes():
+                    if pacenote_slot(pacenote) == slot:
+                        if not job.detach(pacenote):
+                            self.cancel(job, "its pacenote was deleted")
+                        break
+
+    # drops a job that isn't done. a queued job is never sent, and one that's already been
+    # sent stops at its next check and throws its audio away.
+    def cancel(self, job, why="its note changed"):
+        with self.lock:
+            job.cancelled = True
+            self.buckets[job._status].pop(job, None)
+            self.settling_jobs.pop(job, None)
+            self.clear_lock(job)
+            job.clear_force_regen()
+            if self.journal:
+                self.journal.remove(job.id)
+        logging.info(f"cancelled the job for '{job.pacenote}', {why}")
+
+    def _forget_slots(self, job):
+        for pacenote in job.pacenotes():
+            slot = pacenote_slot(pacenote)
+            if self.slot_jobs.get(slot) is job:
+                del self.slot_jobs[slot]
+
+    def set_preferred_codriver(self, codriver_name):
+        self.preferred_codriver = codriver_name
+
+    # lower goes first: forced re-generates, then stage pacenotes before static ones, the
+    # preferred codriver before the others, and the start of the stage before the end.
+    def job_priority(self, pacenote):
+        return (
+            0 if pacenote.is_force_regen() else 1,
+            1 if pacenote.static else 0,
+            0 if pacenote.codriver_name() == self.preferred_codriver else 1,
+            pacenote.position,
+            pacenote.codriver_index,
+        )
 
-        return job
+    # groups the jobs added since the last call by voice config, most urgent first.
+    def take_batches(self, max_batch_size=16):
+        with self.lock:
+            jobs = [job for job in self.pending_jobs if not job.cancelled]
+            self.pending_jobs = []
+        jobs.sort(key=lambda job: job.priority)
+
+        groups = {}
+        for job in jobs:
+            fingerprint = self.settings_manager.voice_config_fingerprint(job.pacenote.voice())
+            groups.setdefault(fingerprint, []).append(job)
+
+        batches = []
+        for fingerprint, group in groups.items():
+            voice_config = group[0].voice_config()
+            for i in range(0, len(group), max_batch_size):
+                batches.append(UpdateJobBatch(self, group[i:i + max_batch_size], voice_config, fingerprint))
+
+        batches.sort(key=lambda batch: batch.priority)
+        return batches
+
+    def schedule_retry(self, job):
+        delay = self.retry_policy.delay(job.attempts)
+        logging.info(f"retrying '{job.pacenote}' in {delay:.1f}s, attempt {job.attempts}/{self.retry_policy.max_attempts} failed")
+        with self.lock:
+            self.touch(job, UPDATE_JOB_STATUS_RETRYING)
+            job.retry_at = job.updated_at() + delay
+            heapq.heappush(self.retry_jobs, (job.retry_at, next(self.retry_seq), job))
+
+    # moves the retries that are due to pending, for the next take_batches(). returns how many.
+    def take_due_retries(self, now=None):
+        now = now or time.time()
+        count = 0
+        with self.lock:
+            while self.retry_jobs and self.retry_jobs[0][0] <= now:
+                _, _, job = heapq.heappop(self.retry_jobs)
+                if job.cancelled:
+                    continue
+                job.retry_at = None
+                self.touch(job, UPDATE_JOB_STATUS_UPDATING)
+                self.pending_jobs.append(job)
+                count += 1
+        return count
+
+    # moves the jobs whose settle time has passed to pending, for the next take_batches().
+    # returns how many.
+    def take_settled_jobs(self, now=None):
+        now = now or time.time()
+        count = 0
+        with self.lock:
+            while self.settling_jobs:
+                job = next(iter(self.settling_jobs))
+                if job.settle_at > now:
+                    break
+                self.settling_jobs.popitem(last=False)
+                job.settle_at = None
+                self.pending_jobs.append(job)
+                count += 1
+        return count
 
     def set_error(self, job):
-        pacenote = job.pacenote
-        id = pacenote_job_id(pacenote)
-        self.pacenote_ids_error[id] = job
+        with self.lock:
+            self.touch(job, UPDATE_JOB_STATUS_ERROR)
+            self.pacenote_ids_error.pop(job.id, None)
+            self.pacenote_ids_error[job.id] = job
+            job.clear_force_regen()
 
+    # only if the id still belongs to this job, and not to a newer one for the same pacenote.
     def clear_lock(self, job):
-        pacenote = job.pacenote
-        id = pacenote_job_id(pacenote)
-        # if id in self.pacenote_ids_lock:
-            # self.pacenote_ids_error[id] = self.pacenote_ids_lock[id]
-        self.pacenote_ids_lock.pop(id, None)
+        with self.lock:
+            if self.pacenote_ids_lock.get(job.id) is job:
+                del self.pacenote_ids_lock[job.id]
 
     def clear_error(self, job):
-        pacenote = job.pacenote
-        id = pacenote_job_id(pacenote)
-        self.pacenote_ids_error.pop(id, None)
-
-    def has_job_for_pacenote(self, pacenote):
-        id = pacenote_job_id(pacenote)
-
-        lock_rv = False
-        err_rv = False
+        with self.lock:
+            if self.pacenote_ids_error.get(job.id) is job:
+                del self.pacenote_ids_error[job.id]
+                if self.journal:
+                    self.journal.remove(job.id)
 
+    def _has_job(self, id, pacenote):
         if id in self.pacenote_ids_lock:
-            job = self.pacenote_ids_lock[id]
-            if job is not None:
-                lock_rv = True
+            return True
 
-        if id in self.pacenote_ids_error:
-            job = self.pacenote_ids_error[id]
-            if job is not None:
-                err_rv = True
+        job = self.pacenote_ids_error.get(id)
+        if job is not None:
+            # a changed note or a forced re-generate gets a fresh try right away.
+            if job.note_text != pacenote.note() or pacenote.is_force_regen():
+                self.clear_error(job)
+            else:
+                return True
 
-        rv = lock_rv or err_rv
-        # logging.debug(f"UpdateJobsStore.has_job_for_pacenote {pacenote.short_name()} | lock_rv={lock_rv} err_rv={err_rv} rv={rv}")
+        return False
 
-        return rv
+    def has_job_for_pacenote(self, pacenote):
+        id = pacenote_job_id(pacenote)
+        with self.lock:
+            return self._has_job(id, pacenote)
 
     def clear_error_for_pacenote(self, pacenote):
         id = pacenote_job_id(pacenote)
+        with self.lock:
+            if self.pacenote_ids_error.pop(id, None) and self.journal:
+                self.journal.remove(id)
+
+    def _load_journal_notebook(self, notebook_file):
+        try:
+            notebook_file.load()
+        except OSError as e:
+            logging.info(f"couldnt load journaled notebook {notebook_file.fname}: {e}")
+            return {}
+        notebook = notebook_file.notebook()
+        if notebook is None:
+            return {}
+        return {(pacenote.codriver_name(), pacenote.name()): pacenote for pacenote in notebook.pacenotes()}
+
+    # failures from the last run keep holding their pacenote back for what's left of the
+    # retry policy's give up time.
+    def _restore_error(self, pacenote, row):
+        if row['updated_at'] < time.time() - self.retry_policy.give_up_sec:
+            self.journal.remove(row['id'])
+            return
+        job = UpdateJob(self, pacenote, row['id'])
+        job.attempts = row['attempts']
+        job._status = UPDATE_JOB_STATUS_ERROR
+        job._updated_at = row['updated_at']
+        with self.lock:
+            self.pacenote_ids_error[job.id] = job
+
+    # re-adds the jobs that weren't done when the app last closed. only the notebooks and
+    # pacenotes named in the journal are looked at, and rows whose pacenote is gone, has
+    # a different note now, or already has its audio are dropped. `notebook_file_for`
+    # gives the NotebookFile for a notebook's fname, so resumed jobs share it with the
+    # tree. returns how many jobs were queued.
+    def resume(self, notebook_file_for):
+        if self.journal is None:
+            return 0
+
+        pacenotes_by_fname = {}
+        resumed = 0
+
+        for row in self.journal.load():
+            fname = row['notebook_fname']
+            if fname not in pacenotes_by_fname:
+                pacenotes_by_fname[fname] = self._load_journal_notebook(notebook_file_for(fname))
+
+            pacenote = pacenotes_by_fname[fname].get((row['codriver_name'], row['pacenote_name']))
+            if pacenote is None or pacenote.note() != row['note'] or pacenote_job_id(pacenote) != row['id']:
+                self.journal.remove(row['id'])
+            elif row['status'] == UPDATE_JOB_STATUS_ERROR:
+                self._restore_error(pacenote, row)
+            elif pacenote.needs_update():
+                job = self.add_job(pacenote, settle=False)
+                if job:
+                    job.attempts = row['attempts']
+                    self.journal_job(job)
+                    resumed += 1
+            else:
+                self.journal.remove(row['id'])
 
-        # if id in self.pacenote_ids_lock:
-        #     job = self.pacenote_ids_lock[id]
-        #     if job is not None:
-        #         self.clear_lock(job)
-
-        if id in self.pacenote_ids_error:
-            job = self.pacenote_ids_error[id]
-            if job is not None:
-                self.clear_error(job)
+        return resumed
 
     def count_by_status(self):
-        counts = {}
-
-        for job in self.jobs:
-            if job.status() not in counts:
-                counts[job.status()] = 0
-            counts[job.status()] = counts[job.status()] + 1
-
-        return counts
+        with self.lock:
+            return {status: len(bucket) for status, bucket in self.buckets.items() if bucket}
 
     def print(self):
-        logging.debug("UpdateJobsStore")
-        logging.debug("  pacenote_ids_lock")
-        for id in self.pacenote_ids_lock:
-            logging.debug(f"    - {id}")
-        logging.debug("  pacenote_ids_error")
-        for id in self.pacenote_ids_error:
-            logging.debug(f"    - {id}")
-        logging.debug("------------------------------------------------")
+        with self.lock:
+            logging.debug("UpdateJobsStore")
+            logging.debug("  pacenote_ids_lock")
+            for id in self.pacenote_ids_lock:
+                logging.debug(f"    - {id}")
+            logging.debug("  pacenote_ids_error")
+            for id in self.pacenote_ids_error:
+                logging.debug(f"    - {id}")
+            logging.debug("------------------------------------------------")
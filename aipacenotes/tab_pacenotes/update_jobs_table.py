@@ -13,9 +13,10 @@ from PyQt6.QtWidgets import (
     QAbstractItemView,
 )
 
+from .row_diff import sync_rows
 from .update_jobs import (
-    pacenote_job_id,
     UPDATE_JOB_STATUS_UPDATING,
+    UPDATE_JOB_STATUS_RETRYING,
     UPDATE_JOB_STATUS_SUCCESS,
     UPDATE_JOB_STATUS_ERROR,
 )
@@ -41,9 +42,22 @@ class UpdateJobsTableModel(QAbstractTableModel):
     def __init__(self, jobs_store):
         super(UpdateJobsTableModel, self).__init__()
         self.jobs_store = jobs_store
+        self.jobs = []
+        self.fingerprints = []
+
+    def row_fingerprint(self, job):
+        return (job.status(), job._cached_updated_at_str, len(job.waiters))
+
+    # diffs the store's jobs against the displayed rows. jobs are matched by identity.
+    def sync(self):
+        new_jobs = self.jobs_store.snapshot()
+        new_fingerprints = [self.row_fingerprint(job) for job in new_jobs]
+        return sync_rows(self, self.jobs, self.fingerprints, new_jobs, new_fingerprints, id)
 
     def rowCount(self, parent=None):
-        return len(self.jobs_store)
+        if parent is not None and parent.isValid():
+            return 0
+        return len(self.jobs)
 
     def columnCount(self, parent=None):
         return 6
@@ -53,7 +67,7 @@ class UpdateJobsTableModel(QAbstractTableModel):
             return None
 
         if role == Qt.ItemDataRole.DisplayRole:
-            job = self.jobs_store.get(index.row())
+            job = self.jobs[index.row()]
             pacenote = job.pacenote
 
             if index.column() == 0:
@@ -67,17 +81,19 @@ class UpdateJobsTableModel(QAbstractTableModel):
             elif index.column() == 4:
                 return pacenote.notebook.name()
             elif index.column() == 5:
-                return pacenote_job_id(pacenote)
+                return ', '.join(job.pacenote_names())
             else:
                 return None
 
         if role == Qt.ItemDataRole.BackgroundRole:
-            job = self.jobs_store.get(index.row())
+            job = self.jobs[index.row()]
             # pacenote = job.pacenote
 
             if index.column() == 0:
                 if job.status() == UPDATE_JOB_STATUS_UPDATING:
                     return QColor(Qt.GlobalColor.cyan)
+                elif job.status() == UPDATE_JOB_STATUS_RETRYING:
+                    return QColor(Qt.GlobalColor.yellow)
                 elif job.status() == UPDATE_JOB_STATUS_SUCCESS:
                     return QColor(Qt.GlobalColor.green)
                 elif job.status() == UPDATE_JOB_STATUS_ERROR:
@@ -0,0 +1,107 @@
+import logging
+import os
+import threading
+
+MANIFEST_FNAME = 'voice_fingerprints.txt'
+
+# which voice config each audio file in a codriver dir was generated with, kept next to
+# the files as lines of "<fingerprint> <basename>". a line is appended per file written and
+# the last one for a file wins, so recording is one small append. the file is rewritten
+# once it's mostly superseded lines. a dir of audio from before there were manifests is
+# taken to be in the voice it's first seen with.
+class VoiceManifest:
+    def __init__(self, dirname, audio_index):
+        self.dirname = dirname
+        self.path = f'{dirname}/{MANIFEST_FNAME}'
+        self.audio_index = audio_index
+        self.lock = threading.Lock()
+        self.fingerprints = None
+        self.line_count = 0
+        # (size, mtime) of the file as last read or written here.
+        self.stat_key = None
+
+    def _stat_key(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_size, st.st_mtime_ns)
+
+    def _read(self):
+        fingerprints = {}
+        line_count = 0
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                fingerprint, _, basename = line.rstrip('\n').rpartition(' ')
+                if basename:
+                    fingerprints[basename] = fingerprint
+                    line_count += 1
+        self.stat_key = self._stat_key()
+        return fingerprints, line_count
+
+    def _write(self, fingerprints):
+        lines = ''.join(f'{fingerprint} {basename}\n' for basename, fingerprint in fingerprints.items())
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(lines)
+        os.replace(tmp_path, self.path)
+        self.audio_index.add(self.path)
+        self.stat_key = self._stat_key()
+        self.line_count = len(fingerprints)
+
+    def _load(self, fingerprint):
+        if self.fingerprints is not None:
+            return
+        try:
+            self.fingerprints, self.line_count = self._read()
+            return
+        except FileNotFoundError:
+            pass
+        except (OSError, UnicodeDecodeError) as e:
+            logging.error(f"couldnt read {self.path}: {e}")
+
+        names = [name for name in self.audio_index.files_in(self.dirname) if name.endswith('.ogg')]
+        self.fingerprints = {name: fingerprint for name in names}
+        if names:
+            try:
+                self._write(self.fingerprints)
+            except OSError as e:
+                logging.error(f"couldnt write {self.path}: {e}")
+
+    # whether the file was generated with a config other than `fingerprint`. files that
+    # aren't in the manifest aren't stale: they're either missing or placed by hand.
+    def is_stale(self, basename, fingerprint):
+        if fingerprint is None:
+            return False
+        with self.lock:
+            self._load(fingerprint)
+            recorded = self.fingerprints.get(basename)
+        return recorded is not None and recorded != fingerprint
+
+    def record(self, basename, fingerprint):
+        if fingerprint is None:
+            return
+        with self.lock:
+            self._load(fingerprint)
+            if self.fingerprints.get(basename) == fingerprint:
+                return
+            self.fingerprints[basename] = fingerprint
+            try:
+                if self.line_count > 2 * len(self.fingerprints) + 16:
+                    self._write(self.fingerprints)
+                else:
+                    with open(self.path, 'a', encoding='utf-8') as f:
+                        f.write(f'{fingerprint} {basename}\n')
+                    self.stat_key = self._stat_key()
+                    self.line_count += 1
+            except OSError as e:
+                logging.error(f"couldnt write {self.path}: {e}")
+
+    # whether the file is still as it was last read or written here.
+    def reflects_disk(self):
+        with self.lock:
+            return self.fingerprints is None or self.stat_key == self._stat_key()
+
+    def invalidate(self):
+        with self.lock:
+            self.fingerprints = None
@@ -21,6 +21,16 @@ def is_dev():
 def normalize_path(in_path):
     return os.path.normpath(in_path).replace("\\", "/")
 
+# writes to a temp file next to `fname` and renames it over the target, so readers only
+# ever see the old or the new content.
+def atomic_write(fname, data):
+    tmp_fname = f"{fname}.tmp"
+    with open(tmp_fname, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_fname, fname)
+
 def clean_name_for_path(a_string):
     a_string = re.sub(r'[^a-zA-Z0-9]', '_', a_string)  # Replace everything but letters and numbers with '_'
     a_string = re.sub(r'_+', '_', a_string)            # Replace multiple consecutive '_' with a single '_'
@@ -0,0 +1,130 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from werkzeug.serving import make_server
+
+import aipacenotes.settings
+from aipacenotes.settings import SettingsManager
+from aipacenotes.concurrency import AsyncEngine
+from aipacenotes.tab_pacenotes.rally_file import NotebookFile
+from aipacenotes.tab_pacenotes.update_jobs import UpdateJobsStore
+from stub_vocalizer import create_app
+
+# generates a notebook's worth of audio against tools/stub_vocalizer.py with the AsyncEngine
+# at several concurrency limits. x10 is the baseline: generation used to run on a
+# TaskManager(10) thread pool, which allowed as many requests at once. run it with nothing
+# else listening on :8080.
+
+VOICE_CONFIG = {'name': 'bench', 'language_code': 'en-US'}
+
+class BenchSettings(SettingsManager):
+    def __init__(self, root):
+        super().__init__(None)
+        self.root = root
+        self.voices = {'bench': VOICE_CONFIG}
+
+    def get_static_pacenotes(self, force=False):
+        return []
+
+    def get_audio_store_dir(self):
+        return os.path.join(self.root, 'audio_store')
+
+    def get_audio_store_limits(self):
+        return {'max_total_mb': 100, 'max_age_days': 1}
+
+    def get_recycle_bin_dir(self):
+        return os.path.join(self.root, 'recycle_bin')
+
+    def get_recycle_bin_limits(self):
+        return {'max_total_mb': 10, 'max_age_days': 1}
+
+class BenchUserSettings:
+    def get_uuid(self):
+        return 'bench'
+
+class DoneCounter:
+    def __init__(self, total):
+        self.total = total
+        self.count = 0
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def emit(self, job):
+        with self.lock:
+            self.count += 1
+            if self.count == self.total:
+                self.done.set()
+
+def make_notebook(root, num_notes):
+    mission_dir = os.path.join(root, 'gameplay', 'missions', 'level', 'rallyStage', 'bench', 'aipacenotes', 'notebooks')
+    os.makedirs(mission_dir)
+    fname = os.path.join(mission_dir, 'bench.notebook.json')
+    data = {
+        'name': 'bench',
+        'codrivers': [{'name': 'codriver', 'language': 'english', 'voice': 'bench'}],
+        'pacenotes': [
+            {'name': f'Pacenote {i}', 'oldId': i, 'notes': {'english': {'note': f'left {i % 6 + 1} into right {i}'}}}
+            for i in range(num_notes)
+        ],
+    }
+    with open(fname, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+
+    settings = BenchSettings(root)
+    notebook_file = NotebookFile(fname, settings)
+    notebook_file.load()
+    return settings, notebook_file
+
+def make_batches(root, num_notes):
+    settings, notebook_file = make_notebook(root, num_notes)
+    store = UpdateJobsStore(settings)
+    for pacenote in notebook_file.notebook().pacenotes():
+        store.add_job(pacenote, settle=False)
+    # one note per request, so the concurrency limit is what's measured.
+    return store.take_batches(max_batch_size=1)
+
+def bench_async(num_notes, concurrency):
+    with tempfile.TemporaryDirectory() as root:
+        batches = make_batches(root, num_notes)
+        done = DoneCounter(num_notes)
+        engine = AsyncEngine(concurrency)
+        engine.start()
+        start = time.perf_counter()
+        for batch in batches:
+            engine.submit(batch.run_async(engine, done))
+        done.done.wait()
+        duration = time.perf_counter() - start
+        engine.stop()
+        return duration
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--notes', type=int, default=400)
+    parser.add_argument('--latency', type=float, default=0.25, help='stub server seconds per request')
+    args = parser.parse_args()
+
+    aipacenotes.settings.set_local_vocalizer(True)
+    aipacenotes.settings.user_settings = BenchUserSettings()
+
+    app = create_app(args.latency, 0.0, True)
+    server = make_server('localhost', 8080, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    print(f"{args.notes} notes, {args.latency * 1000:.0f}ms per request")
+
+    for concurrency in [10, 50, 200]:
+        duration = bench_async(args.notes, concurrency)
+        print(f"{f'async x{concurrency}':>12}: {duration:6.2f}s {args.notes / duration:7.1f} notes/s")
+
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
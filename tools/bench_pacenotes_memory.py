@@ -0,0 +1,88 @@
+import copy
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from aipacenotes.tab_pacenotes.rally_file import NotebookFile
+
+NUM_PACENOTES = 5000
+NUM_CODRIVERS = 4
+LANGUAGES = ['english', 'german']
+
+class StaticPacenotesSettings:
+    def get_static_pacenotes(self):
+        return [
+            {'name': f'static_{i}', 'oldId': -i, 'notes': {lang: {'note': f'static note {i}'} for lang in LANGUAGES}}
+            for i in range(20)
+        ]
+
+def make_notebook_data():
+    codrivers = [
+        {'name': f'codriver_{i}', 'language': LANGUAGES[i % len(LANGUAGES)], 'voice': f'voice_{i}', 'pk': i}
+        for i in range(NUM_CODRIVERS)
+    ]
+    pacenotes = []
+    for i in range(NUM_PACENOTES):
+        pacenotes.append({
+            'name': f'Pacenote {i}',
+            'oldId': i,
+            'segment': -1,
+            'metadata': {'static': False},
+            'pacenoteWaypoints': [
+                {'name': 'corner start', 'pos': [i * 1.5, i * 2.5, 100.0], 'normal': [0.0, 1.0, 0.0], 'radius': 8.0, 'waypointType': 'fwdAudioTrigger'},
+                {'name': 'curve', 'pos': [i * 1.5 + 3, i * 2.5, 100.0], 'normal': [0.0, 1.0, 0.0], 'radius': 8.0, 'waypointType': 'cornerStart'},
+                {'name': 'curve end', 'pos': [i * 1.5 + 6, i * 2.5, 100.0], 'normal': [0.0, 1.0, 0.0], 'radius': 8.0, 'waypointType': 'cornerEnd'},
+            ],
+            'notes': {lang: {'before': '', 'note': f'left {i % 6 + 1} into right {i % 5 + 1}', 'after': ''} for lang in LANGUAGES},
+        })
+    return {'name': 'bench', 'codrivers': codrivers, 'pacenotes': pacenotes}
+
+# the pre-slots expansion, kept here as the baseline: one deep copy of the source
+# dict per pacenote x codriver.
+def deepcopy_expansion(notebook):
+    rv = []
+    for codriver_data in notebook.data['codrivers']:
+        for pacenote_data in notebook.data['pacenotes'] + notebook.notebook_file.static_pacenotes:
+            for lang, note_data in pacenote_data['notes'].items():
+                if codriver_data['language'] == lang:
+                    pn_data_copy = copy.deepcopy(pacenote_data)
+                    pn_data_copy['note'] = note_data['note']
+                    pn_data_copy['language'] = lang
+                    pn_data_copy['codriver'] = codriver_data
+                    rv.append(pn_data_copy)
+    return rv
+
+def measure(name, fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    duration_ms = (time.perf_counter() - start) * 1000
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:>10}: {len(result)} pacenotes, retained {current / 1048576:.1f} MB, peak {peak / 1048576:.1f} MB, {duration_ms:.0f}ms")
+    return current
+
+def main():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        mission_dir = os.path.join(tmpdir, 'gameplay', 'missions', 'level', 'rallyStage', 'bench', 'aipacenotes', 'notebooks')
+        os.makedirs(mission_dir)
+        fname = os.path.join(mission_dir, 'bench.notebook.json')
+        with open(fname, 'w', encoding='utf-8') as f:
+            json.dump(make_notebook_data(), f)
+
+        notebook_file = NotebookFile(fname, StaticPacenotesSettings())
+        notebook_file.load()
+        notebook = notebook_file.notebook()
+
+        print(f"{NUM_PACENOTES} pacenotes x {NUM_CODRIVERS} codrivers")
+        baseline = measure('deepcopy', lambda: deepcopy_expansion(notebook))
+        slotted = measure('slots', lambda: notebook.pacenotes(use_cache=False))
+        print(f"reduction: {baseline / max(slotted, 1):.1f}x")
+
+if __name__ == '__main__':
+    main()
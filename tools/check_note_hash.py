@@ -0,0 +1,45 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from aipacenotes.tab_pacenotes import rally_file
+
+# checks the note hash against values from the game mod, which names the audio files it
+# plays by it. both the per-note path and the numpy path used for many uncached notes
+# must match it bit for bit, or generated audio is never found in game.
+
+GOLDEN = {
+    '': 0,
+    'left 3': 1157028104,
+    'links 3 über Kuppe': 796776000,
+    'ちょっと': 39158659,
+    '[empty]': 1944190044,
+}
+
+# enough extra notes to push note_hashes() over its threshold for the numpy path.
+FILLER = [f'filler {i}' for i in range(32)]
+
+def check(name, got):
+    for text, expected in GOLDEN.items():
+        assert got[text] == expected, f'{name}: {text!r} hashed to {got[text]}, expected {expected}'
+    print(f"{name}: ok")
+
+def main():
+    rally_file._note_hash_cache.clear()
+    check('scalar', {text: rally_file.note_hash(text) for text in GOLDEN})
+
+    texts = list(GOLDEN) + FILLER
+    check('numpy', dict(zip(texts, rally_file._note_hashes_vectorized(texts))))
+
+    # through the public entry point, with nothing cached so the numpy path is taken.
+    rally_file._note_hash_cache.clear()
+    hashes = dict(zip(texts, rally_file.note_hashes(texts)))
+    check('note_hashes', hashes)
+
+    for text in FILLER:
+        assert hashes[text] == rally_file._note_hash_uncached(text), f'numpy and scalar disagree on {text!r}'
+    print(f"numpy and scalar agree on {len(FILLER)} more notes")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+import argparse
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from aipacenotes.tab_pacenotes.update_jobs import (
+    UpdateJobsStore,
+    UPDATE_JOB_STATUS_UPDATING,
+    UPDATE_JOB_STATUS_RETRYING,
+    UPDATE_JOB_STATUS_SUCCESS,
+    UPDATE_JOB_STATUS_ERROR,
+)
+
+# adds a lot of jobs to an UpdateJobsStore, then finishes them from several threads while
+# others list, count, prune and look jobs up the way the gui and refresh threads do, and
+# checks the store's indexes still agree with each other at the end.
+
+class StressPacenote:
+    def __init__(self, i):
+        self.i = i
+        self.static = False
+        self.position = i
+        self.codriver_index = 0
+        self.notebook = types.SimpleNamespace(notebook_file=types.SimpleNamespace(fname='/stress/stress.notebook.json'))
+
+    def name(self):
+        return f'Pacenote {self.i}'
+
+    def note(self):
+        return f'left {self.i}'
+
+    def note_abs_path(self):
+        return f'/stress/codriver/pacenote_{self.i}.ogg'
+
+    def codriver_name(self):
+        return 'codriver'
+
+    def voice(self):
+        return 'stress'
+
+    def is_force_regen(self):
+        return False
+
+    def clear_force_regen(self):
+        pass
+
+    def __str__(self):
+        return self.name()
+
+class NullSignal:
+    def emit(self, job):
+        pass
+
+def complete(store, jobs, results, results_lock):
+    signal = NullSignal()
+    counts = {'success': 0, 'retry': 0, 'error': 0}
+    for job in jobs:
+        roll = random.random()
+        if roll < 0.8:
+            store.touch(job, UPDATE_JOB_STATUS_SUCCESS)
+            counts['success'] += 1
+        elif roll < 0.9:
+            job.set_error(retryable=True)
+            counts['retry'] += 1
+        else:
+            job.set_error()
+            counts['error'] += 1
+        job.finish(signal)
+    with results_lock:
+        for k, v in counts.items():
+            results[k] += v
+
+def read_until(store, pacenotes, done, stats):
+    while not done.is_set():
+        start = time.perf_counter()
+        store.count_by_status()
+        stats['count_sec'] = max(stats['count_sec'], time.perf_counter() - start)
+        for pacenote in random.sample(pacenotes, 100):
+            store.has_job_for_pacenote(pacenote)
+        store.snapshot()
+        store.prune()
+        stats['reads'] += 1
+
+def check(store, expected):
+    snapshot = store.snapshot()
+    counts = store.count_by_status()
+    assert len(snapshot) == len(store) == sum(counts.values()), 'counts disagree with the job list'
+    assert len(set(map(id, snapshot))) == len(snapshot), 'a job is listed twice'
+    for status, bucket in store.buckets.items():
+        for job in bucket:
+            assert job.status() == status, f'{job.id} is {job.status()} but in the {status} bucket'
+
+    for job in snapshot:
+        locked = store.pacenote_ids_lock.get(job.id) is job
+        assert locked != job.is_done(), f'{job.id} is {job.status()} but locked={locked}'
+
+    for status, count in expected.items():
+        assert counts.get(status, 0) == count, f'{status}: expected {count}, got {counts.get(status, 0)}'
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=50000)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    store = UpdateJobsStore(None)
+    pacenotes = [StressPacenote(i) for i in range(args.jobs)]
+
+    start = time.perf_counter()
+    jobs = [store.add_job(pacenote, settle=False) for pacenote in pacenotes]
+    duration = time.perf_counter() - start
+    print(f"add {args.jobs} jobs: {duration:.2f}s ({duration / args.jobs * 1e6:.1f}us each)")
+    assert all(jobs) and not any(store.add_job(pacenote) for pacenote in pacenotes[:100])
+    store.pending_jobs = []
+
+    done = threading.Event()
+    stats = {'reads': 0, 'count_sec': 0.0}
+    reader = threading.Thread(target=read_until, args=(store, pacenotes, done, stats))
+    reader.start()
+
+    results = {'success': 0, 'retry': 0, 'error': 0}
+    results_lock = threading.Lock()
+    chunks = [jobs[i::args.threads] for i in range(args.threads)]
+    threads = [threading.Thread(target=complete, args=(store, chunk, results, results_lock)) for chunk in chunks]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+    done.set()
+    reader.join()
+
+    print(f"finish {args.jobs} jobs on {args.threads} threads: {duration:.2f}s ({duration / args.jobs * 1e6:.1f}us each)")
+    print(f"{stats['reads']} reader passes, slowest count_by_status: {stats['count_sec'] * 1e6:.1f}us")
+
+    check(store, {
+        UPDATE_JOB_STATUS_SUCCESS: results['success'],
+        UPDATE_JOB_STATUS_RETRYING: results['retry'],
+        UPDATE_JOB_STATUS_ERROR: results['error'],
+        UPDATE_JOB_STATUS_UPDATING: 0,
+    })
+
+    # every retry comes due, and goes back to updating.
+    retried = store.take_due_retries(now=time.time() + 3600)
+    assert retried == results['retry'] and len(store.pending_jobs) == retried
+    check(store, {
+        UPDATE_JOB_STATUS_SUCCESS: results['success'],
+        UPDATE_JOB_STATUS_RETRYING: 0,
+        UPDATE_JOB_STATUS_UPDATING: retried,
+    })
+
+    print(f"ok: {results}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import argparse
+import functools
+import io
+import os
+import sys
+import time
+
+import numpy as np
+import soundfile as sf
+from flask import Flask, Response, jsonify, request
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from aipacenotes.client.client import (
+    create_pacenotes_audio_url,
+    create_pacenotes_audio_batch_url,
+    translate_all_url,
+    encode_batch_frame,
+)
+
+# a stand-in for the vocalizer, for running the app with --local-vocalizer without
+# any TTS backend. every note becomes a short tone whose pitch depends on the text.
+
+SAMPLE_RATE = 22050
+
+def make_audio(note_text):
+    duration = 0.2 + 0.02 * len(note_text)
+    freq = 220 + (sum(note_text.encode('utf-8')) % 440)
+    return make_tone(freq, duration)
+
+# encoding is slow enough to be what's measured by benchmarks, so tones are reused.
+@functools.lru_cache(maxsize=4096)
+def make_tone(freq, duration):
+    t = np.arange(int(SAMPLE_RATE * duration)) / SAMPLE_RATE
+    data = 0.2 * np.sin(2 * np.pi * freq * t)
+    buf = io.BytesIO()
+    sf.write(buf, data, SAMPLE_RATE, format='OGG')
+    return buf.getvalue()
+
+def create_app(latency, per_note_latency, batch):
+    app = Flask(__name__)
+    stats = {'requests': 0, 'notes': 0}
+
+    @app.route(create_pacenotes_audio_url, methods=['POST'])
+    def create():
+        stats['requests'] += 1
+        stats['notes'] += 1
+        time.sleep(latency + per_note_latency)
+        return Response(make_audio(request.json['note_text']), mimetype='audio/ogg')
+
+    if batch:
+        @app.route(create_pacenotes_audio_batch_url, methods=['POST'])
+        def create_batch():
+            notes = request.json['notes']
+            stats['requests'] += 1
+            stats['notes'] += len(notes)
+
+            def generate():
+                time.sleep(latency)
+                for i, note in enumerate(notes):
+                    time.sleep(per_note_latency)
+                    yield encode_batch_frame(i, True, make_audio(note['note_text']))
+
+            return Response(generate(), mimetype='application/octet-stream')
+
+    @app.route(translate_all_url, methods=['POST'])
+    def translate_all():
+        body = request.json
+        lang = body['target_language_name']
+        pacenotes = []
+        for pacenote in body['pacenotes']:
+            notes = pacenote['notes'][body['input_language']]
+            pacenotes.append({
+                'oldId': pacenote['oldId'],
+                'notes': {lang: {k: f'[{lang}] {v}' if v else v for k, v in notes.items()}},
+            })
+        return jsonify({'ok': True, 'pacenotes': pacenotes})
+
+    @app.route('/stats')
+    def get_stats():
+        return jsonify(stats)
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in vocalizer for --local-vocalizer.")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.3, help='seconds added to every request')
+    parser.add_argument('--per-note-latency', type=float, default=0.05, help='seconds added for every note')
+    parser.add_argument('--no-batch', action='store_true', help='act like a server without the batch endpoint')
+    args = parser.parse_args()
+
+    app = create_app(args.latency, args.per_note_latency, not args.no_batch)
+    app.run(port=args.port, threaded=True)
+
+if __name__ == '__main__':
+    main()